@@ -1,45 +1,88 @@
 #!/usr/bin/env python3
 """
 Скрипт для загрузки данных из JSON файлов в базу данных через API.
-Загружает тексты из всех JSON файлов в папке processed_data и отправляет их батчами по 50 штук.
+Загружает тексты с метаданными из всех JSON файлов в папке processed_data,
+ставит их в фоновую индексацию (/ingest_jobs) и опрашивает прогресс задания.
 """
 
 import json
 from pathlib import Path
 import requests
-from typing import List
+from typing import Any, Dict, List, Tuple
 import time
 
 
-API_URL = "http://158.160.168.247:8083/add_chunks"
-BATCH_SIZE = 50
+API_URL = "http://158.160.168.247:8083"
+POLL_INTERVAL = 2
 PROCESSED_DATA_DIR = Path(__file__).parent.parent / "processed_data"
 
 
-def load_texts_from_json(file_path: Path) -> List[str]:
-    """Загружает тексты из JSON файла."""
+def load_texts_from_json(file_path: Path) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Загружает тексты и их метаданные из JSON файла."""
     print(f"Читаем файл: {file_path.name}")
     with open(file_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    texts = [item['text'] for item in data if 'text' in item]
+    items = [item for item in data if 'text' in item]
+    texts = [item['text'] for item in items]
+    # Источник (имя файла) — партиция корпуса в db-service
+    metadatas = [
+        {"source": file_path.stem, **(item.get('metadata') or {})}
+        for item in items
+    ]
     print(f"  Загружено {len(texts)} текстов из {file_path.name}")
-    return texts
+    return texts, metadatas
 
 
-def send_batch(texts: List[str], batch_num: int) -> bool:
-    """Отправляет батч текстов на API."""
-    payload = {"texts": texts}
-
+def submit_job(texts: List[str], metadatas: List[Dict[str, Any]]) -> str | None:
+    """Отправляет тексты на фоновую индексацию, возвращает id задания."""
     try:
-        print(f"Отправка батча #{batch_num} ({len(texts)} текстов)...")
-        response = requests.post(API_URL, json=payload, timeout=30)
+        response = requests.post(
+            f"{API_URL}/ingest_jobs",
+            json={"texts": texts, "metadatas": metadatas},
+            timeout=30,
+        )
         response.raise_for_status()
-        print(f"  ✓ Батч #{batch_num} успешно загружен")
-        return True
     except requests.exceptions.RequestException as e:
-        print(f"  ✗ Ошибка при отправке батча #{batch_num}: {e}")
-        return False
+        print(f"  ✗ Ошибка при постановке задания: {e}")
+        return None
+
+    job_id = response.json()["job_id"]
+    print(f"  ✓ Задание {job_id} поставлено в очередь")
+    return job_id
+
+
+def wait_job(job_id: str) -> dict | None:
+    """
+    Опрашивает статус задания до его завершения.
+    None — сервис задание не знает (например, был перезапущен).
+    """
+    while True:
+        try:
+            response = requests.get(f"{API_URL}/ingest_jobs/{job_id}", timeout=30)
+            if response.status_code == 404:
+                print(
+                    "  ✗ Задание не найдено: сервис, вероятно, перезапущен. "
+                    "Запустите загрузку заново — уже загруженные тексты "
+                    "будут пропущены"
+                )
+                return None
+            response.raise_for_status()
+            status = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"  ✗ Ошибка при опросе задания: {e}")
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(
+            f"  Батчей: {status['batches_done']}/{status['batches_total']}, "
+            f"добавлено: {status['added']}, пропущено: {status['skipped']}, "
+            f"ошибок: {status['failed']}"
+        )
+        if status["status"] in ("done", "failed"):
+            return status
+
+        time.sleep(POLL_INTERVAL)
 
 
 def load_all_data():
@@ -60,36 +103,31 @@ def load_all_data():
 
     # Собираем все тексты
     all_texts = []
+    all_metadatas = []
     for json_file in sorted(json_files):
-        texts = load_texts_from_json(json_file)
+        texts, metadatas = load_texts_from_json(json_file)
         all_texts.extend(texts)
+        all_metadatas.extend(metadatas)
 
     print("=" * 60)
     print(f"Всего текстов для загрузки: {len(all_texts)}")
-    print(f"Количество батчей: {(len(all_texts) + BATCH_SIZE - 1) // BATCH_SIZE}")
     print("=" * 60)
 
-    # Отправляем батчами
-    successful_batches = 0
-    failed_batches = 0
-
-    for i in range(0, len(all_texts), BATCH_SIZE):
-        batch = all_texts[i:i + BATCH_SIZE]
-        batch_num = (i // BATCH_SIZE) + 1
-
-        if send_batch(batch, batch_num):
-            successful_batches += 1
-        else:
-            failed_batches += 1
+    job_id = submit_job(all_texts, all_metadatas)
+    if job_id is None:
+        return
 
-        # Небольшая пауза между запросами
-        time.sleep(0.5)
+    status = wait_job(job_id)
+    if status is None:
+        return
 
     print("=" * 60)
-    print(f"Загрузка завершена!")
-    print(f"  Успешно: {successful_batches} батчей")
-    print(f"  Ошибок: {failed_batches} батчей")
-    print(f"  Всего загружено: {successful_batches * BATCH_SIZE} текстов (приблизительно)")
+    print(f"Загрузка завершена со статусом {status['status']}")
+    print(f"  Добавлено: {status['added']} текстов")
+    print(f"  Уже были в базе: {status['skipped']} текстов")
+    print(f"  Ошибок: {status['failed']} текстов")
+    for error in status["errors"]:
+        print(f"    {error}")
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
+import logging
+
 import httpx
 from typing import List
 from pydantic import BaseModel
@@ -5,6 +7,9 @@ from pydantic import BaseModel
 from api.core.config import settings
 
 
+logger = logging.getLogger(__name__)
+
+
 class SearchQuery(BaseModel):
     """Схема запроса для поиска в db-service"""
     top_k: int
@@ -45,6 +50,7 @@ class DBServiceClient:
         try:
             response = self.sync_client.post(url, json=payload.model_dump())
             response.raise_for_status()
+            self._log_timings(response)
 
             chunks = Chunks(**response.json())
             return chunks.texts
@@ -71,12 +77,20 @@ class DBServiceClient:
         try:
             response = await self.async_client.post(url, json=payload.model_dump())
             response.raise_for_status()
+            self._log_timings(response)
 
             chunks = Chunks(**response.json())
             return chunks.texts
         except httpx.HTTPError as e:
             raise Exception(f"Error retrieving documents from db-service: {e}")
 
+    @staticmethod
+    def _log_timings(response: httpx.Response) -> None:
+        """Логирует разбивку времени поиска по этапам из заголовка Server-Timing"""
+        timings = response.headers.get("Server-Timing")
+        if timings:
+            logger.info(f"db-service retrieve timings: {timings}")
+
     async def close(self):
         """Закрывает соединение с клиентами"""
         await self.async_client.aclose()
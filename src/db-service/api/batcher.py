@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+from .metrics import BATCH_SIZE, BATCH_WAIT
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Динамический микробатчинг: запросы конкурентных вызывающих копятся
+    до max_wait_ms или max_batch элементов и уходят в handler одним
+    вызовом, а результаты раздаются обратно по вызывающим.
+
+    Одновременно в handler находится не больше max_inflight батчей:
+    пока батч обрабатывается, следующий успевает накопиться.
+
+    Если общий вызов упал, элементы каждого вызывающего отправляются
+    в handler отдельно: ошибка одного (например, слишком длинный текст
+    в батче загрузки) не достается остальным.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_wait_ms: float,
+        max_batch: int,
+        max_inflight: int = 1,
+    ):
+        self.name = name
+        self.handler = handler
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.max_inflight = max(1, max_inflight)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._dispatches: set = set()
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._task = asyncio.create_task(self._collect())
+
+    async def submit(self, items: List[Any]) -> List[Any]:
+        """Отправить элементы в общий батч и дождаться своих результатов."""
+        if not items:
+            return []
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((items, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._inflight.acquire()
+            groups = [await self._queue.get()]
+            size = len(groups[0][0])
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    group = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                groups.append(group)
+                size += len(group[0])
+
+            task = asyncio.create_task(self._dispatch(groups))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, groups: List[tuple]) -> None:
+        try:
+            flat = [item for items, _, _ in groups for item in items]
+            now = time.perf_counter()
+            BATCH_SIZE.labels(self.name).observe(len(flat))
+            for _, _, queued_at in groups:
+                BATCH_WAIT.labels(self.name).observe(now - queued_at)
+
+            try:
+                results = await self.handler(flat)
+            except Exception as e:
+                if len(groups) == 1:
+                    self._set_exception(groups[0][1], e)
+                    return
+                logger.warning(
+                    "%s batcher: батч из %d вызовов не удался, "
+                    "повторяем по вызывающим: %s",
+                    self.name,
+                    len(groups),
+                    e,
+                )
+                await asyncio.gather(
+                    *(self._dispatch_one(items, future) for items, future, _ in groups)
+                )
+                return
+
+            offset = 0
+            for items, future, _ in groups:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(items)])
+                offset += len(items)
+
+            logger.info(
+                "%s batcher: callers=%d items=%d", self.name, len(groups), len(flat)
+            )
+        finally:
+            self._inflight.release()
+
+    async def _dispatch_one(self, items: List[Any], future: asyncio.Future) -> None:
+        try:
+            results = await self.handler(items)
+        except Exception as e:
+            self._set_exception(future, e)
+        else:
+            if not future.done():
+                future.set_result(results)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, error: Exception) -> None:
+        if not future.done():
+            future.set_exception(error)
+
+    async def close(self) -> None:
+        tasks = list(self._dispatches)
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,237 @@
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from . import config
+from .candidates import collapse_duplicates, select_candidates, shortlist_candidates
+from .late_interaction import index_tokens, late_interaction_scores
+from .quantization import build_codes, top_indices
+from .retrieval import search_partitions
+from .store import VectorStore
+from .utils import _cross_encoder_scores, _score_documents, embed_queries
+from .vectors import truncate
+
+
+def _exact_top(vectors: np.ndarray, query: np.ndarray, k: int, exclude: int) -> set:
+    scores = vectors @ query
+    scores[exclude] = -np.inf
+    return set(top_indices(scores, k).tolist())
+
+
+def index_benchmark(
+    vectors: np.ndarray,
+    k: int,
+    samples: int,
+    rescore_factor: int,
+    modes: Sequence[str] = ("none", "int8", "binary"),
+    dims: Sequence[int] = (0, 1024, 512, 256),
+) -> List[Dict]:
+    """
+    Сравнение вариантов первого прохода на векторах корпуса: запросами
+    служат случайные векторы самого корпуса (без совпадения с собой).
+    Для каждого сочетания квантования и Matryoshka-размерности (0 — полная)
+    — память под индекс первого прохода, recall@k относительно точного
+    перебора после рескоринга шортлиста и среднее время запроса.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    full_dim = vectors.shape[1]
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), min(samples, len(vectors)), replace=False)
+    truth = {int(i): _exact_top(vectors, vectors[i], k, int(i)) for i in sample}
+
+    report = []
+    for dim in dict.fromkeys(d if 0 < d < full_dim else 0 for d in dims):
+        first = truncate(vectors, dim)
+        for mode in modes:
+            codes = build_codes(mode, first)
+            exact = codes is None and dim == 0
+            hits = 0
+            started = time.perf_counter()
+
+            for i in sample:
+                query = vectors[i]
+                if exact:
+                    scores = vectors @ query
+                else:
+                    first_query = truncate(query, dim)
+                    if codes is None:
+                        approx = first @ first_query
+                    else:
+                        approx = codes.scores(first_query)
+                    approx[i] = -np.inf
+                    rows = top_indices(approx, (k + 1) * rescore_factor)
+                    scores = np.full(len(vectors), -np.inf, dtype=np.float32)
+                    scores[rows] = vectors[rows] @ query
+                scores[i] = -np.inf
+                hits += len(truth[int(i)] & set(top_indices(scores, k).tolist()))
+
+            elapsed = time.perf_counter() - started
+            report.append(
+                {
+                    "mode": mode,
+                    "dim": dim or full_dim,
+                    "memory_bytes": int(
+                        first.nbytes if codes is None else codes.nbytes
+                    ),
+                    f"recall@{k}": round(hits / (k * len(sample)), 4),
+                    "latency_ms": round(elapsed / len(sample) * 1000, 3),
+                }
+            )
+
+    return report
+
+
+async def _candidate_pools(
+    store: VectorStore, queries: List[str], k: int
+) -> List[Tuple[str, List[Dict]]]:
+    """Кандидаты на реранк для каждого запроса, как в /retrieve."""
+    vectors = await embed_queries(queries)
+    pools = []
+    for query, vector in zip(queries, vectors):
+        found = await store.search(vector, config.candidate_limit)
+        pool = collapse_duplicates(select_candidates(found, k))
+        if pool:
+            pools.append((query, pool))
+    return pools
+
+
+async def cascade_benchmark(
+    store: VectorStore,
+    queries: List[str],
+    k: int,
+    sizes: Sequence[int] = (5, 10, 15),
+) -> List[Dict]:
+    """
+    Сравнение каскада реранка с полным реранком на заданных запросах.
+    Эталон — top-k полного реранка всех кандидатов; для каждого размера
+    шортлиста — recall@k относительно эталона, число пар в реранкере и
+    среднее время первого этапа и реранка. Кэш оценок не используется,
+    чтобы время реранка было честным.
+    """
+    pools = await _candidate_pools(store, queries, k)
+
+    rows = {}
+    truth = {}
+    for query, pool in pools:
+        texts = [c["text"] for c in pool]
+        started = time.perf_counter()
+        scores = await _score_documents(query, texts)
+        elapsed = time.perf_counter() - started
+        top = np.argsort(scores)[::-1][:k]
+        truth[query] = {texts[i] for i in top}
+
+        row = rows.setdefault(0, {"hits": 0, "docs": 0, "first": 0.0, "rerank": 0.0})
+        row["hits"] += len(truth[query])
+        row["docs"] += len(texts)
+        row["rerank"] += elapsed
+
+    for size in sorted({s for s in sizes if s > 0}):
+        row = rows.setdefault(
+            size, {"hits": 0, "docs": 0, "first": 0.0, "rerank": 0.0}
+        )
+        for query, pool in pools:
+            started = time.perf_counter()
+            short = shortlist_candidates(query, pool, max(size, k))
+            shortlisted = time.perf_counter()
+            texts = [c["text"] for c in short]
+            scores = await _score_documents(query, texts)
+            row["first"] += shortlisted - started
+            row["rerank"] += time.perf_counter() - shortlisted
+            row["docs"] += len(texts)
+            top = np.argsort(scores)[::-1][:k]
+            row["hits"] += len(truth[query] & {texts[i] for i in top})
+
+    total = max(1, sum(len(t) for t in truth.values()))
+    n = max(1, len(pools))
+    return [
+        {
+            "shortlist": size or "full",
+            f"recall@{k}": round(row["hits"] / total, 4),
+            "reranked": round(row["docs"] / n, 1),
+            "first_stage_ms": round(row["first"] / n * 1000, 3),
+            "rerank_ms": round(row["rerank"] / n * 1000, 1),
+        }
+        for size, row in rows.items()
+    ]
+
+
+async def rerank_benchmark(store: VectorStore, queries: List[str], k: int) -> Dict:
+    """
+    Late-interaction реранк против кросс-энкодера на заданных запросах:
+    recall@k относительно top-k кросс-энкодера и среднее время обоих.
+    Токенные векторы кандидатов досчитываются заранее, так что время
+    late-interaction — установившееся, без догрузки.
+    """
+    pools = await _candidate_pools(store, queries, k)
+    await index_tokens([c["text"] for _, pool in pools for c in pool])
+
+    hits = total = 0
+    cross_time = late_time = 0.0
+    for query, pool in pools:
+        texts = [c["text"] for c in pool]
+
+        started = time.perf_counter()
+        cross = await _cross_encoder_scores(query, texts)
+        crossed = time.perf_counter()
+        late = await late_interaction_scores(query, texts)
+        cross_time += crossed - started
+        late_time += time.perf_counter() - crossed
+
+        truth = set(np.argsort(cross)[::-1][:k].tolist())
+        hits += len(truth & set(np.argsort(late)[::-1][:k].tolist()))
+        total += len(truth)
+
+    n = max(1, len(pools))
+    return {
+        "queries": len(pools),
+        "candidates": round(sum(len(pool) for _, pool in pools) / n, 1),
+        f"recall@{k}": round(hits / max(1, total), 4),
+        "cross_ms": round(cross_time / n * 1000, 1),
+        "late_ms": round(late_time / n * 1000, 1),
+    }
+
+
+async def routing_benchmark(store: VectorStore, queries: List[str], k: int) -> Dict:
+    """
+    Поиск по партициям маршрутизатора против поиска по всему корпусу:
+    recall@k и recall пула кандидатов (candidate_limit) относительно
+    полного поиска, сколько партиций в среднем просматривается и время
+    обоих поисков. Работает и при выключенном PARTITION_ROUTING.
+    """
+    vectors = await embed_queries(queries)
+
+    hits = total = pool_hits = pool_total = routed = searched = 0
+    full_time = routed_time = 0.0
+    for vector in vectors:
+        started = time.perf_counter()
+        full = await store.search(vector, config.candidate_limit)
+        full_time += time.perf_counter() - started
+
+        partitions = store.partitions.route(vector, record=False)
+        started = time.perf_counter()
+        found = await search_partitions(
+            store, vector, config.candidate_limit, partitions
+        )
+        routed_time += time.perf_counter() - started
+        if partitions:
+            routed += 1
+            searched += len(partitions)
+
+        truth = {c["text"] for c in full[:k]}
+        hits += len(truth & {c["text"] for c in found[:k]})
+        total += len(truth)
+        pool = {c["text"] for c in full}
+        pool_hits += len(pool & {c["text"] for c in found})
+        pool_total += len(pool)
+
+    n = max(1, len(vectors))
+    return {
+        "queries": len(vectors),
+        "routed": routed,
+        "partitions": round(searched / max(1, routed), 2),
+        f"recall@{k}": round(hits / max(1, total), 4),
+        "candidate_recall": round(pool_hits / max(1, pool_total), 4),
+        "full_ms": round(full_time / n * 1000, 1),
+        "routed_ms": round(routed_time / n * 1000, 1),
+    }
@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+from redis.asyncio import Redis
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Привести запрос к каноничному виду: регистр и пробелы не важны."""
+    return " ".join(text.lower().split())
+
+
+def text_hash(*parts: str) -> str:
+    """Стабильный ключ по набору строк."""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LRUCache:
+    """In-process LRU с опциональным TTL и счетчиками."""
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов: LRU в памяти процесса и опционально Redis.
+    Ключ — нормализованный текст запроса и имя модели.
+    """
+
+    def __init__(self, model: str, redis: Optional[Redis] = None):
+        self.model = model or ""
+        self.local = LRUCache(config.embed_cache_size, config.embed_cache_ttl)
+        self.redis = redis
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def _key(self, text: str) -> str:
+        return text_hash(self.model, normalize_query(text))
+
+    async def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        vector = self.local.get(key)
+        if vector is not None or self.redis is None:
+            return vector
+
+        try:
+            raw = await self.redis.get(f"emb:{key}")
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("Redis недоступен для кэша эмбеддингов: %s", e)
+            return None
+
+        if raw is None:
+            self.redis_misses += 1
+            return None
+
+        self.redis_hits += 1
+        vector = np.frombuffer(raw, dtype="<f4")
+        self.local.set(key, vector)
+        return vector
+
+    async def set(self, text: str, vector: np.ndarray) -> None:
+        key = self._key(text)
+        self.local.set(key, vector)
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.set(
+                f"emb:{key}",
+                np.asarray(vector, dtype="<f4").tobytes(),
+                ex=config.embed_cache_redis_ttl,
+            )
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning("Redis недоступен для кэша эмбеддингов: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local": self.local.stats(),
+            "redis": {
+                "enabled": self.redis is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors,
+            },
+        }
+
+
+class ResultCache:
+    """
+    Кэш результатов /retrieve по (запрос, top_k, версия корпуса).
+    Любая запись в корпус поднимает версию, так что устаревшие
+    результаты никогда не отдаются.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(config.result_cache_size, config.result_cache_ttl)
+        self.corpus_version = 0
+
+    def _key(self, query: str, top_k: int) -> tuple:
+        return (normalize_query(query), top_k, self.corpus_version)
+
+    def get(self, query: str, top_k: int) -> Optional[List[str]]:
+        return self.local.get(self._key(query, top_k))
+
+    def set(
+        self,
+        query: str,
+        top_k: int,
+        texts: List[str],
+        corpus_version: int,
+    ) -> None:
+        """
+        corpus_version — версия, на которой начинали поиск: если корпус
+        успел измениться, результат уже устарел и не кэшируется.
+        """
+        if corpus_version != self.corpus_version:
+            return
+        self.local.set(self._key(query, top_k), texts)
+
+    def bump_version(self) -> None:
+        """Корпус изменился: старые записи недостижимы, освобождаем память."""
+        self.corpus_version += 1
+        self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.local.stats(), "corpus_version": self.corpus_version}
+
+
+class ScoreCache:
+    """
+    Кэш оценок реранкера по (хэш нормализованного запроса, хэш чанка).
+    Переформулировки и повторы запросов переиспользуют оценки пар,
+    которые уже считались.
+    """
+
+    def __init__(self, model: str):
+        self.model = model or ""
+        self.local = LRUCache(config.score_cache_size, config.score_cache_ttl)
+
+    def _query_key(self, query: str) -> str:
+        return text_hash(self.model, normalize_query(query))
+
+    def get_many(self, query: str, documents: List[str]) -> List[Optional[float]]:
+        query_key = self._query_key(query)
+        return [self.local.get((query_key, text_hash(doc))) for doc in documents]
+
+    def set_many(
+        self,
+        query: str,
+        documents: List[str],
+        scores: List[float],
+    ) -> None:
+        query_key = self._query_key(query)
+        for doc, score in zip(documents, scores):
+            self.local.set((query_key, text_hash(doc)), score)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.local.stats()
+
+
+_redis: Optional[Redis] = None
+_embedding_cache: Optional[EmbeddingCache] = None
+_result_cache: Optional[ResultCache] = None
+_score_cache: Optional[ScoreCache] = None
+
+
+def init_caches() -> None:
+    """Создать кэши и подключение к Redis. Вызывается при старте."""
+    global _redis, _embedding_cache, _result_cache, _score_cache
+    if config.redis_url:
+        _redis = Redis.from_url(config.redis_url)
+    _embedding_cache = EmbeddingCache(config.embed_model, _redis)
+    _result_cache = ResultCache()
+    # Оценки разных режимов реранка несравнимы — разные ключи кэша
+    _score_cache = ScoreCache(
+        f"late:{config.token_embed_model}"
+        if config.rerank_mode == "late"
+        else config.reranker_model
+    )
+
+
+async def close_caches() -> None:
+    """Закрыть подключение к Redis. Вызывается при остановке."""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    if _embedding_cache is None:
+        raise RuntimeError("Кэш эмбеддингов не инициализирован")
+    return _embedding_cache
+
+
+def get_result_cache() -> ResultCache:
+    if _result_cache is None:
+        raise RuntimeError("Кэш результатов не инициализирован")
+    return _result_cache
+
+
+def get_score_cache() -> ScoreCache:
+    if _score_cache is None:
+        raise RuntimeError("Кэш оценок реранкера не инициализирован")
+    return _score_cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "embeddings": get_embedding_cache().stats(),
+        "results": get_result_cache().stats(),
+        "scores": get_score_cache().stats(),
+    }
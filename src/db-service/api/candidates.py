@@ -0,0 +1,281 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def select_candidates(candidates: List[Dict], top_k: int) -> List[Dict]:
+    """
+    Адаптивно урезать пул кандидатов перед реранком по дистанциям.
+
+    Кандидаты отсортированы по возрастанию дистанции. Оставляем тех,
+    кто не дальше лучшего на candidate_distance_margin, и обрезаем хвост
+    на первом скачке дистанции не меньше candidate_distance_gap.
+    Размер пула остается в пределах [max(candidate_min_pool, top_k),
+    candidate_limit].
+    """
+    max_pool = config.candidate_limit
+    min_pool = min(max(config.candidate_min_pool, top_k), max_pool)
+
+    if len(candidates) <= min_pool:
+        return candidates
+
+    distances = [c.get("distance") for c in candidates]
+    if any(d is None for d in distances):
+        return candidates[:max_pool]
+
+    cut = len(candidates)
+
+    if config.candidate_distance_margin > 0:
+        threshold = distances[0] + config.candidate_distance_margin
+        cut = sum(1 for d in distances if d <= threshold)
+
+    if config.candidate_distance_gap > 0:
+        for idx in range(min_pool, cut):
+            if distances[idx] - distances[idx - 1] >= config.candidate_distance_gap:
+                cut = idx
+                break
+
+    cut = max(min_pool, min(cut, max_pool))
+    selected = candidates[:cut]
+
+    logger.info(
+        "candidates: fetched=%d kept=%d pruned=%d",
+        len(candidates),
+        len(selected),
+        len(candidates) - len(selected),
+    )
+    return selected
+
+
+# Параметры хэш-функций MinHash (multiply-shift по 64-битным хэшам)
+_MINHASH_PERM = 32
+_rng = np.random.default_rng(0)
+_MINHASH_A = _rng.integers(1, 2**63, _MINHASH_PERM, dtype=np.uint64) | np.uint64(1)
+_MINHASH_B = _rng.integers(0, 2**63, _MINHASH_PERM, dtype=np.uint64)
+
+
+def _minhash(texts: List[List[str]], size: int) -> np.ndarray:
+    """MinHash-сигнатуры (len(texts), _MINHASH_PERM) множеств k-грамм слов."""
+    # Короткие тексты дополняются пустыми словами до одной k-граммы
+    texts = [words + [""] * (size - len(words)) for words in texts]
+    lengths = np.array([len(words) for words in texts])
+    hashes = np.fromiter(
+        (hash(w) & 0xFFFFFFFFFFFFFFFF for words in texts for w in words),
+        dtype=np.uint64,
+        count=int(lengths.sum()),
+    )
+
+    # Хэш k-граммы — полиномиальная свертка хэшей слов (mod 2**64) по всем
+    # текстам сразу; k-граммы через границу текстов отбрасываются ниже
+    grams = hashes.copy()
+    for offset in range(1, size):
+        grams[:-offset] = grams[:-offset] * np.uint64(1000003) + hashes[offset:]
+
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    widths = lengths - size + 1
+    position = np.arange(len(hashes)) - np.repeat(starts, lengths)
+    grams = grams[position < np.repeat(widths, lengths)]
+    offsets = np.concatenate(([0], np.cumsum(widths)[:-1]))
+
+    mixed = (grams[None, :] * _MINHASH_A[:, None] + _MINHASH_B[:, None]) >> np.uint64(32)
+    return np.minimum.reduceat(mixed, offsets, axis=1).T
+
+
+def _overlaps(words: List[List[str]], size: int) -> Dict[Tuple[int, int], int]:
+    """
+    Стыки соседних окон: (i, j) -> длина в словах, если хвост окна i
+    совпадает с началом окна j и не короче size слов.
+    """
+    starts: Dict[str, List[int]] = {}
+    for j, w in enumerate(words):
+        if len(w) >= size:
+            starts.setdefault(w[0], []).append(j)
+
+    links: Dict[Tuple[int, int], int] = {}
+    for i, a in enumerate(words):
+        for pos in range(len(a) - size + 1):
+            for j in starts.get(a[pos], ()):
+                length = len(a) - pos
+                if (
+                    j != i
+                    and (i, j) not in links
+                    and length <= len(words[j])
+                    and a[pos:] == words[j][:length]
+                ):
+                    links[(i, j)] = length
+    return links
+
+
+def collapse_duplicates(candidates: List[Dict]) -> List[Dict]:
+    """
+    Схлопнуть почти-дубликаты среди кандидатов перед реранком.
+
+    Перекрывающиеся окна одной статьи (split_text_into_chunks) и чанки
+    с MinHash-оценкой сходства шинглов не меньше dedup_threshold собираются в группы.
+    От группы на реранк идет один представитель — ближайший к запросу,
+    а в поле "context" лежит текст для ответа: с dedup_merge окно
+    представителя склеено по стыкам с соседними окнами без повторов.
+    """
+    if not config.candidate_dedup or len(candidates) < 2:
+        return candidates
+
+    size = max(1, config.dedup_min_overlap)
+    words = [c["text"].split() for c in candidates]
+    links = _overlaps(words, size)
+    # Оценка сходства Жаккара по шинглам: доля совпавших минимумов
+    signatures = _minhash(words, config.dedup_shingle)
+    similar = (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+
+    parent = list(range(len(candidates)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Цепочки соседних окон: next_of[i] = (j, длина стыка)
+    next_of: Dict[int, Tuple[int, int]] = {}
+    prev_of: Dict[int, int] = {}
+
+    for i in range(len(candidates)):
+        for j in range(i + 1, len(candidates)):
+            link = None
+            if (i, j) in links:
+                link = (i, j, links[(i, j)])
+            elif (j, i) in links:
+                link = (j, i, links[(j, i)])
+
+            if link is not None:
+                first, second, length = link
+                if first not in next_of and second not in prev_of:
+                    next_of[first] = (second, length)
+                    prev_of[second] = first
+            elif similar[i, j] < config.dedup_threshold:
+                continue
+
+            parent[find(j)] = find(i)
+
+    groups: Dict[int, List[int]] = {}
+    for idx in range(len(candidates)):
+        groups.setdefault(find(idx), []).append(idx)
+
+    collapsed = []
+    for members in groups.values():
+        head = members[0]
+        item = dict(candidates[head])
+        item["context"] = item["text"]
+        if config.dedup_merge and len(members) > 1:
+            merged = _merge_chain(head, words, next_of, prev_of)
+            if merged is not None:
+                item["context"] = merged
+        item["members"] = len(members)
+        collapsed.append(item)
+
+    if len(collapsed) < len(candidates):
+        logger.info(
+            "candidates: collapsed %d -> %d", len(candidates), len(collapsed)
+        )
+    return collapsed
+
+
+def _merge_chain(
+    head: int,
+    words: List[List[str]],
+    next_of: Dict[int, Tuple[int, int]],
+    prev_of: Dict[int, int],
+) -> Optional[str]:
+    """
+    Склеить head с соседними окнами по стыкам: только с непосредственными
+    соседями, а не со всей цепочкой — иначе один результат разрастается
+    до целой статьи. None — соседей у head нет.
+    """
+    prev = prev_of.get(head)
+    following = next_of.get(head)
+    if following is not None and following[0] == prev:
+        following = None
+    if prev is None and following is None:
+        return None
+
+    if prev is not None:
+        merged = list(words[prev]) + words[head][next_of[prev][1]:]
+    else:
+        merged = list(words[head])
+    if following is not None:
+        current, length = following
+        merged.extend(words[current][length:])
+    return " ".join(merged)
+
+
+_WORD_RE = re.compile(r"\w+")
+
+# Параметры BM25
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def _tokens(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def bm25_scores(query: str, texts: List[str]) -> List[float]:
+    """BM25 запроса по текстам кандидатов (IDF считается по ним же)."""
+    docs = [Counter(_tokens(text)) for text in texts]
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_length = sum(lengths) / len(docs) or 1.0
+    terms = set(_tokens(query))
+
+    idf = {}
+    for term in terms:
+        df = sum(1 for doc in docs if term in doc)
+        idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+
+    scores = []
+    for doc, length in zip(docs, lengths):
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_length)
+        scores.append(
+            sum(
+                idf[term] * doc[term] * (_BM25_K1 + 1) / (doc[term] + norm)
+                for term in terms
+                if term in doc
+            )
+        )
+    return scores
+
+
+def shortlist_candidates(query: str, candidates: List[Dict], size: int) -> List[Dict]:
+    """
+    Первый этап каскада реранка: оставить size кандидатов по RRF-слиянию
+    лексического ранга (BM25) и векторного (исходный порядок по дистанции).
+    Результат отсортирован по слитому скору — этот порядок используется
+    и при деградации реранка до векторного.
+    """
+    if size <= 0 or len(candidates) <= size:
+        return candidates
+
+    lexical = bm25_scores(query, [c["text"] for c in candidates])
+    lexical_rank = {
+        idx: rank
+        for rank, idx in enumerate(
+            sorted(range(len(candidates)), key=lambda i: -lexical[i])
+        )
+    }
+
+    k = config.cascade_rrf_k
+    fused = [
+        1 / (k + idx + 1) + 1 / (k + lexical_rank[idx] + 1)
+        for idx in range(len(candidates))
+    ]
+    order = sorted(range(len(candidates)), key=lambda i: -fused[i])[:size]
+
+    logger.info("candidates: shortlist %d -> %d", len(candidates), len(order))
+    return [candidates[idx] for idx in order]
@@ -0,0 +1,61 @@
+from typing import Optional
+
+import httpx
+
+from . import config
+
+
+# Общие keep-alive клиенты, создаются в lifespan приложения
+_embed_client: Optional[httpx.AsyncClient] = None
+_reranker_client: Optional[httpx.AsyncClient] = None
+_token_client: Optional[httpx.AsyncClient] = None
+
+
+def _make_client(base_url: str, timeout: float) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=config.http_max_connections,
+        max_keepalive_connections=config.http_max_keepalive,
+        keepalive_expiry=config.http_keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        base_url=base_url or "",
+        limits=limits,
+        timeout=httpx.Timeout(timeout, connect=config.http_connect_timeout),
+    )
+
+
+def init_http_clients() -> None:
+    """Создать пулы соединений к эмбеддеру и реранкеру. Вызывается при старте."""
+    global _embed_client, _reranker_client, _token_client
+    _embed_client = _make_client(config.embed_url, config.embed_timeout)
+    _reranker_client = _make_client(config.reranker_url, config.reranker_timeout)
+    _token_client = _make_client(config.token_embed_url, config.embed_timeout)
+
+
+async def close_http_clients() -> None:
+    """Закрыть пулы соединений. Вызывается при остановке."""
+    global _embed_client, _reranker_client, _token_client
+    for client in (_embed_client, _reranker_client, _token_client):
+        if client is not None:
+            await client.aclose()
+    _embed_client = None
+    _reranker_client = None
+    _token_client = None
+
+
+def get_embed_client() -> httpx.AsyncClient:
+    if _embed_client is None:
+        raise RuntimeError("HTTP-клиент эмбеддера не инициализирован")
+    return _embed_client
+
+
+def get_reranker_client() -> httpx.AsyncClient:
+    if _reranker_client is None:
+        raise RuntimeError("HTTP-клиент реранкера не инициализирован")
+    return _reranker_client
+
+
+def get_token_client() -> httpx.AsyncClient:
+    if _token_client is None:
+        raise RuntimeError("HTTP-клиент токенных эмбеддингов не инициализирован")
+    return _token_client
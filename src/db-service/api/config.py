@@ -0,0 +1,174 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+weaviate_url = os.getenv("WEAVIATE_URL")
+
+embed_url = os.getenv("EMBEDDING_URL")
+embed_model = os.getenv("EMBEDDING_MODEL")
+# Получать эмбеддинги в base64 (float32), а не JSON-массивами
+embed_base64 = _env_bool("EMBEDDING_BASE64", True)
+# Склеивать тексты конкурентных вызовов в один запрос /v1/embeddings
+embed_coalesce = _env_bool("EMBED_COALESCE", True)
+embed_batch_max_wait_ms = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+embed_batch_max_size = int(os.getenv("EMBED_BATCH_MAX_SIZE", "256"))
+embed_batch_max_inflight = int(os.getenv("EMBED_BATCH_MAX_INFLIGHT", "2"))
+reranker_url = os.getenv("RERANKER_URL")
+reranker_model = os.getenv("RERANKER_MODEL")
+
+# Отправлять всех кандидатов реранкеру одним запросом (text_2 — список)
+reranker_batch = _env_bool("RERANKER_BATCH", True)
+# Сколько одиночных запросов к реранкеру выполнять параллельно при фолбэке
+reranker_concurrency = int(os.getenv("RERANKER_CONCURRENCY", "4"))
+# Режим реранка: cross (кросс-энкодер через /v1/score) или late
+# (late interaction: MaxSim по токенным векторам, считается на CPU)
+rerank_mode = os.getenv("RERANK_MODE", "cross").lower()
+# Модель токенных эмбеддингов (ColBERT-подобная, vLLM /pooling)
+token_embed_url = os.getenv("TOKEN_EMBED_URL", embed_url or "")
+token_embed_model = os.getenv("TOKEN_EMBED_MODEL", "")
+# Где хранить токенные векторы чанков (float16 memmap)
+token_store_path = os.getenv("TOKEN_STORE_PATH", "data/token_store")
+# Склеивать пары (запрос, чанк) конкурентных /retrieve в один вызов /v1/score
+rerank_coalesce = _env_bool("RERANK_COALESCE", True)
+rerank_batch_max_wait_ms = float(os.getenv("RERANK_BATCH_MAX_WAIT_MS", "5"))
+rerank_batch_max_size = int(os.getenv("RERANK_BATCH_MAX_SIZE", "128"))
+rerank_batch_max_inflight = int(os.getenv("RERANK_BATCH_MAX_INFLIGHT", "1"))
+
+# Пул HTTP-соединений к эмбеддеру и реранкеру
+http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+http_max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))
+http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+embed_timeout = float(os.getenv("EMBEDDING_TIMEOUT", "60"))
+reranker_timeout = float(os.getenv("RERANKER_TIMEOUT", "60"))
+
+# Потоки для синхронного weaviate-клиента: поиск и запись разведены,
+# чтобы большой батч индексации не забирал потоки у интерактивного поиска
+weaviate_search_workers = int(os.getenv("WEAVIATE_SEARCH_WORKERS", "8"))
+weaviate_write_workers = int(os.getenv("WEAVIATE_WRITE_WORKERS", "1"))
+weaviate_batch_size = int(os.getenv("WEAVIATE_BATCH_SIZE", "100"))
+# Подключение к Weaviate и создание схемы идут в фоне после старта:
+# число попыток и экспоненциальная пауза между ними (сек)
+weaviate_connect_retries = int(os.getenv("WEAVIATE_CONNECT_RETRIES", "10"))
+weaviate_connect_backoff = float(os.getenv("WEAVIATE_CONNECT_BACKOFF", "0.5"))
+weaviate_connect_backoff_max = float(os.getenv("WEAVIATE_CONNECT_BACKOFF_MAX", "10"))
+# Таймаут одной проверки зависимости в /ready (сек)
+ready_timeout = float(os.getenv("READY_TIMEOUT", "2"))
+# Квантование HNSW-индекса нового класса: none, int8 (SQ) или binary (BQ)
+weaviate_quantization = os.getenv("WEAVIATE_QUANTIZATION", "none").lower()
+# После скольких объектов Weaviate обучает SQ и начинает сжимать векторы.
+# Дефолт Weaviate (100000) больше корпуса — квантование бы не включилось
+weaviate_sq_training_limit = int(os.getenv("WEAVIATE_SQ_TRAINING_LIMIT", "1000"))
+# Сколько кандидатов забирать из хранилища перед реранком (максимум пула)
+candidate_limit = int(os.getenv("CANDIDATE_LIMIT", "30"))
+# Адаптивный пул: не меньше min_pool кандидатов, отсекаем тех, кто дальше
+# лучшего на distance_margin, и хвост после скачка дистанции >= distance_gap.
+# Нулевые margin/gap отключают соответствующее правило.
+candidate_min_pool = int(os.getenv("CANDIDATE_MIN_POOL", "10"))
+candidate_distance_margin = float(os.getenv("CANDIDATE_DISTANCE_MARGIN", "0.15"))
+candidate_distance_gap = float(os.getenv("CANDIDATE_DISTANCE_GAP", "0.05"))
+# Схлопывать почти-дубликаты среди кандидатов до реранка: соседние окна
+# одной статьи (общий стык не короче dedup_min_overlap слов) и чанки
+# со сходством шинглов (MinHash) >= dedup_threshold. С dedup_merge окно
+# представителя склеивается с непосредственными соседями в один фрагмент.
+candidate_dedup = _env_bool("CANDIDATE_DEDUP", True)
+dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+dedup_shingle = int(os.getenv("DEDUP_SHINGLE", "5"))
+dedup_min_overlap = int(os.getenv("DEDUP_MIN_OVERLAP", "20"))
+dedup_merge = _env_bool("DEDUP_MERGE", True)
+# Каскад реранка: дешевый первый этап (BM25 по текстам кандидатов + порядок
+# по векторной близости, слияние RRF) оставляет rerank_shortlist кандидатов
+# для кросс-энкодера. 0 — в реранкер уходят все кандидаты.
+rerank_shortlist = int(os.getenv("RERANK_SHORTLIST", "0"))
+cascade_rrf_k = int(os.getenv("CASCADE_RRF_K", "60"))
+
+# Redis для кэшей, переживающих рестарт (пусто — только in-process кэш)
+redis_url = os.getenv("REDIS_URL", "")
+
+# Кэш эмбеддингов запросов
+embed_cache_size = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+embed_cache_ttl = float(os.getenv("EMBED_CACHE_TTL", "86400"))
+embed_cache_redis_ttl = int(os.getenv("EMBED_CACHE_REDIS_TTL", "604800"))
+
+# Кэш готовых результатов /retrieve, сбрасывается при изменении корпуса
+result_cache_size = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+result_cache_ttl = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+
+# Кэш оценок реранкера по парам (запрос, чанк)
+score_cache_size = int(os.getenv("SCORE_CACHE_SIZE", "65536"))
+score_cache_ttl = float(os.getenv("SCORE_CACHE_TTL", "86400"))
+
+# Фоновые задания индексации
+# Оценка токенов на вызов эмбеддера (~3 символа на токен для ru/en текста)
+ingest_token_budget = int(os.getenv("INGEST_TOKEN_BUDGET", "8192"))
+ingest_max_batch = int(os.getenv("INGEST_MAX_BATCH", "64"))
+ingest_retries = int(os.getenv("INGEST_RETRIES", "3"))
+ingest_retry_delay = float(os.getenv("INGEST_RETRY_DELAY", "2"))
+# Сколько завершенных заданий хранить для опроса статуса
+ingest_keep_jobs = int(os.getenv("INGEST_KEEP_JOBS", "100"))
+
+# Сколько запросов /retrieve_batch ищутся и реранкаются одновременно
+retrieve_batch_concurrency = int(os.getenv("RETRIEVE_BATCH_CONCURRENCY", "4"))
+
+# Бэкенд векторного хранилища: weaviate или local (NumPy memmap в процессе)
+vector_store = os.getenv("VECTOR_STORE", "weaviate").lower()
+local_store_path = os.getenv("LOCAL_STORE_PATH", "data/local_store")
+local_store_workers = int(os.getenv("LOCAL_STORE_WORKERS", "4"))
+# Индекс локального хранилища: flat (точный перебор) или ivf
+local_store_index = os.getenv("LOCAL_STORE_INDEX", "flat").lower()
+# IVF включается только на корпусе не меньше ivf_min_size, иначе — перебор
+ivf_min_size = int(os.getenv("IVF_MIN_SIZE", "20000"))
+# Число кластеров IVF (0 — sqrt от размера корпуса)
+ivf_nlist = int(os.getenv("IVF_NLIST", "0"))
+ivf_nprobe = int(os.getenv("IVF_NPROBE", "8"))
+# Квантование векторов локального хранилища для первого прохода поиска:
+# none, int8 или binary. Полные векторы остаются на диске для рескоринга.
+local_store_quantization = os.getenv("LOCAL_STORE_QUANTIZATION", "none").lower()
+# Во сколько раз шортлист первого прохода (квантованного или усеченного)
+# больше limit перед рескорингом полными векторами
+rescore_factor = int(os.getenv("RESCORE_FACTOR", "4"))
+# То же для Weaviate с ANN_DIM: полные векторы шортлиста приходят
+# JSON-массивами через GraphQL (~80 КБ на 4096-мерный вектор), поэтому
+# шортлист меньше, чем у локального хранилища
+weaviate_rescore_factor = int(os.getenv("WEAVIATE_RESCORE_FACTOR", "2"))
+
+# Matryoshka: размерность векторов для первого прохода ANN (0 — полная).
+# Полные векторы используются только для рескоринга шортлиста.
+ann_dim = int(os.getenv("ANN_DIM", "0"))
+
+# Быстрый ответ на канонические вопросы Q&A (поле question в метаданных):
+# при совпадении с известным вопросом /retrieve сразу отдает чанк
+# с ответом, без эмбеддинга и реранка. Нечеткое совпадение (порог по
+# триграммам) выключено по умолчанию: близкие по символам вопросы
+# бывают противоположными по смыслу.
+question_shortcut = _env_bool("QUESTION_SHORTCUT", True)
+question_shortcut_fuzzy = _env_bool("QUESTION_SHORTCUT_FUZZY", False)
+question_shortcut_threshold = float(os.getenv("QUESTION_SHORTCUT_THRESHOLD", "0.9"))
+question_index_path = os.getenv("QUESTION_INDEX_PATH", "data/question_index.jsonl")
+
+# Тематические партиции (источник корпуса из метаданных, поле source):
+# запрос ищется только в router_max_partitions ближайших по центроиду
+# партициях, отстающих от лучшей не больше чем на router_margin.
+# Выключено, пока recall не проверен на корпусе (POST /benchmark/routing).
+partition_routing = _env_bool("PARTITION_ROUTING", False)
+router_max_partitions = int(os.getenv("ROUTER_MAX_PARTITIONS", "2"))
+router_margin = float(os.getenv("ROUTER_MARGIN", "0.05"))
+# Состояние маршрутизатора для Weaviate (локальное хранилище держит его у себя)
+partitions_path = os.getenv("PARTITIONS_PATH", "data/partitions.json")
+
+# Снапшоты коллекции (векторы + тексты + метаданные) для восстановления
+# без повторного эмбеддинга: каталог, внутри которого лежат все снапшоты,
+# и размер пачки. Не внутри data/ — там том Weaviate, который снапшот
+# и должен пережить
+snapshot_dir = os.getenv("SNAPSHOT_DIR", "snapshots")
+snapshot_batch_size = int(os.getenv("SNAPSHOT_BATCH_SIZE", "1000"))
+
+# Бюджет времени на /retrieve по умолчанию, мс (0 — без ограничения).
+# Если реранк не укладывается в остаток, отдаем векторный порядок.
+retrieve_budget_ms = float(os.getenv("RETRIEVE_BUDGET_MS", "5000"))
+# Сколько неуспевших запросов к реранкеру доигрывается в фоне ради кэша
+# оценок; сверх этого они отменяются, чтобы отставание не копилось
+rerank_background_max = int(os.getenv("RERANK_BACKGROUND_MAX", "8"))
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from . import config
+from .cache import get_result_cache
+from .late_interaction import index_tokens
+from .metrics import ERRORS
+from .schemas import IngestJobStatus
+from .shortcut import index_questions
+from .store import VectorStore
+from .utils import chunk_uuid, embed_texts
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 3)
+
+
+def split_by_token_budget(
+    texts: List[str],
+    budget: int,
+    max_batch: int,
+) -> List[List[int]]:
+    """Разбить индексы текстов на батчи не больше budget токенов и max_batch штук."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    tokens = 0
+
+    for idx, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if current and (tokens + cost > budget or len(current) >= max_batch):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(idx)
+        tokens += cost
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def select_new_chunks(
+    store: VectorStore,
+    texts: List[str],
+    metadatas: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """
+    Id по содержимому: дубли схлопываются, уже загруженные чанки
+    отбрасываются. Возвращает (uuids, texts, metadatas) новых чанков.
+    """
+    metadatas = metadatas or [{} for _ in texts]
+    by_id = {
+        chunk_uuid(text): (text, meta or {}) for text, meta in zip(texts, metadatas)
+    }
+    existing = await store.existing_ids(list(by_id))
+    uuids = [obj_id for obj_id in by_id if obj_id not in existing]
+    return (
+        uuids,
+        [by_id[obj_id][0] for obj_id in uuids],
+        [by_id[obj_id][1] for obj_id in uuids],
+    )
+
+
+async def index_chunk_tokens(texts: List[str]) -> None:
+    """
+    Токенные векторы новых чанков для late-interaction реранка.
+    Ошибка не роняет загрузку: недостающие векторы досчитаются
+    при первом реранке этих чанков.
+    """
+    if config.rerank_mode != "late":
+        return
+    try:
+        await index_tokens(texts)
+    except Exception as e:
+        ERRORS.labels("tokens").inc()
+        logger.warning("Не удалось посчитать токенные векторы: %s", e)
+
+
+async def _with_retries(name: str, func: Callable[[], Awaitable[T]]) -> T:
+    attempts = max(1, config.ingest_retries)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            logger.warning(
+                "%s: попытка %d/%d не удалась: %s", name, attempt, attempts, e
+            )
+            await asyncio.sleep(config.ingest_retry_delay * attempt)
+
+
+class IngestJob:
+    def __init__(
+        self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        self.texts = texts
+        self.metadatas = metadatas
+        self.status = IngestJobStatus(
+            job_id=uuid.uuid4().hex,
+            status="pending",
+            total=len(texts),
+        )
+        self.task: Optional[asyncio.Task] = None
+
+
+class IngestManager:
+    """
+    Фоновая индексация: чанки режутся на батчи по бюджету токенов,
+    эмбеддинг батча N+1 идет параллельно с записью батча N в хранилище.
+    Упавший батч повторяется отдельно, остальные продолжают грузиться.
+    """
+
+    def __init__(self, store: VectorStore):
+        self.store = store
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+
+    def submit(
+        self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> IngestJobStatus:
+        job = IngestJob(texts, metadatas)
+        self.jobs[job.status.job_id] = job
+        self._forget_finished()
+        job.task = asyncio.create_task(self._run(job))
+        return job.status
+
+    def get(self, job_id: str) -> Optional[IngestJobStatus]:
+        job = self.jobs.get(job_id)
+        return job.status if job else None
+
+    def _forget_finished(self) -> None:
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status.status in ("done", "failed")
+        ]
+        for job_id in finished[: max(0, len(finished) - config.ingest_keep_jobs)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: IngestJob) -> None:
+        try:
+            await self._process(job)
+        finally:
+            # Завершенные задания хранятся ради статуса (ingest_keep_jobs),
+            # сами тексты корпуса держать в памяти незачем
+            job.texts = []
+            job.metadatas = None
+
+    async def _process(self, job: IngestJob) -> None:
+        status = job.status
+        status.status = "running"
+        started = time.perf_counter()
+
+        try:
+            uuids, texts, metadatas = await _with_retries(
+                "ingest lookup",
+                lambda: select_new_chunks(self.store, job.texts, job.metadatas),
+            )
+        except Exception as e:
+            status.status = "failed"
+            status.errors.append(f"Ошибка поиска в хранилище: {e}")
+            return
+
+        status.skipped = len(job.texts) - len(texts)
+
+        # Чанки, которые уже есть в коллекции: их вопросы попадут в индекс
+        # быстрых ответов вместе с записанными батчами, в конце задания
+        new_ids = set(uuids)
+        stored_texts: List[str] = []
+        stored_metadatas: List[Dict[str, Any]] = []
+        for text, meta in zip(job.texts, job.metadatas or [{}] * len(job.texts)):
+            if chunk_uuid(text) not in new_ids:
+                stored_texts.append(text)
+                stored_metadatas.append(meta or {})
+
+        batches = split_by_token_budget(
+            texts, config.ingest_token_budget, config.ingest_max_batch
+        )
+        status.batches_total = len(batches)
+
+        # Очередь на один батч: пока пишется батч N, эмбеддится N+1
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+        async def embed_stage() -> None:
+            for num, batch in enumerate(batches, start=1):
+                batch_texts = [texts[i] for i in batch]
+                try:
+                    vectors = await _with_retries(
+                        f"ingest embed #{num}",
+                        lambda: embed_texts(batch_texts),
+                    )
+                    if len(vectors) != len(batch_texts):
+                        raise RuntimeError(
+                            "Количество эмбеддингов не совпадает "
+                            "с количеством чанков"
+                        )
+                except Exception as e:
+                    self._fail_batch(status, num, len(batch), e)
+                    continue
+                await index_chunk_tokens(batch_texts)
+                await queue.put((num, batch, vectors))
+            await queue.put(None)
+
+        async def write_stage() -> None:
+            while (item := await queue.get()) is not None:
+                num, batch, vectors = item
+                batch_texts = [texts[i] for i in batch]
+                batch_uuids = [uuids[i] for i in batch]
+                batch_metadatas = [metadatas[i] for i in batch]
+                try:
+                    await _with_retries(
+                        f"ingest write #{num}",
+                        lambda: self.store.add(
+                            batch_texts, vectors, batch_uuids, batch_metadatas
+                        ),
+                    )
+                except Exception as e:
+                    self._fail_batch(status, num, len(batch), e)
+                else:
+                    status.added += len(batch)
+                    status.batches_done += 1
+                    stored_texts.extend(batch_texts)
+                    stored_metadatas.extend(batch_metadatas)
+                finally:
+                    get_result_cache().bump_version()
+
+        await asyncio.gather(embed_stage(), write_stage())
+        await index_questions(stored_texts, stored_metadatas)
+
+        status.status = "failed" if status.failed and not status.added else "done"
+        logger.info(
+            "ingest job %s: added=%d skipped=%d failed=%d took=%.1fs",
+            status.job_id,
+            status.added,
+            status.skipped,
+            status.failed,
+            time.perf_counter() - started,
+        )
+
+    @staticmethod
+    def _fail_batch(
+        status: IngestJobStatus,
+        num: int,
+        size: int,
+        error: Exception,
+    ) -> None:
+        ERRORS.labels("ingest").inc()
+        status.failed += size
+        status.batches_done += 1
+        status.errors.append(f"Батч #{num}: {error}")
+        logger.error(
+            "ingest job %s: батч #%d не загружен: %s", status.job_id, num, error
+        )
+
+    async def close(self) -> None:
+        """Остановить незавершенные задания. Вызывается при остановке."""
+        tasks = [
+            job.task
+            for job in self.jobs.values()
+            if job.task and not job.task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from . import config
+from .cache import text_hash
+from .clients import get_token_client
+from .vectors import normalize
+
+
+logger = logging.getLogger(__name__)
+
+
+async def embed_tokens(texts: List[str]) -> List[np.ndarray]:
+    """
+    Токенные эмбеддинги (ColBERT-подобная модель через vLLM /pooling):
+    для каждого текста матрица (число токенов, dim) с нормированными строками.
+    """
+    payload = {"model": config.token_embed_model, "input": texts}
+
+    started = time.perf_counter()
+    try:
+        resp = await get_token_client().post("/pooling", json=payload)
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"Ошибка запроса к токенному эмбеддеру: {e}")
+
+    if resp.status_code != 200:
+        raise RuntimeError(
+            f"Токенный эмбеддер вернул {resp.status_code}: {resp.text[:500]}"
+        )
+
+    data = sorted(resp.json()["data"], key=lambda item: item.get("index", 0))
+    if len(data) != len(texts):
+        raise RuntimeError("Количество токенных эмбеддингов не совпадает с текстами")
+    matrices = [
+        normalize(np.atleast_2d(np.asarray(item["data"], dtype=np.float32)))
+        for item in data
+    ]
+
+    logger.info(
+        "embed tokens: texts=%d tokens=%d took=%.1fms",
+        len(texts),
+        sum(len(m) for m in matrices),
+        (time.perf_counter() - started) * 1000,
+    )
+    return matrices
+
+
+def maxsim(query: np.ndarray, tokens: np.ndarray, counts: List[int]) -> np.ndarray:
+    """
+    MaxSim одним матричным умножением: для каждого документа (подряд идущие
+    counts[i] строк tokens) — среднее по токенам запроса максимума
+    косинусной близости с токенами документа.
+    """
+    sims = tokens @ query.T
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    return np.maximum.reduceat(sims, offsets, axis=0).mean(axis=1)
+
+
+class TokenStore:
+    """
+    Токенные векторы чанков для late-interaction реранка: строки float16
+    подряд в tokens.f16 (дописывается в конец, читается через memmap),
+    в index.jsonl — по строке на чанк с ключом текста и диапазоном строк.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._tokens_path = self.path / "tokens.f16"
+        self._index_path = self.path / "index.jsonl"
+        self._meta_path = self.path / "meta.json"
+
+        self._dim: Optional[int] = None
+        self._rows: Optional[np.ndarray] = None
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._end = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tokens")
+        self._load()
+
+    def _load(self) -> None:
+        if self._meta_path.exists():
+            self._dim = json.loads(self._meta_path.read_text())["dim"]
+
+        index = {}
+        if self._index_path.exists():
+            with open(self._index_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        index[item["key"]] = (item["start"], item["count"])
+        self._index = index
+        self._end = max((start + count for start, count in index.values()), default=0)
+        self._remap()
+
+        logger.info(
+            "token store: loaded %d chunks, %d tokens from %s",
+            len(index),
+            self._end,
+            self.path,
+        )
+
+    def _remap(self) -> None:
+        if self._dim is None or not self._tokens_path.exists():
+            return
+        rows = self._tokens_path.stat().st_size // (2 * self._dim)
+        if rows:
+            self._rows = np.memmap(
+                self._tokens_path, dtype=np.float16, mode="r", shape=(rows, self._dim)
+            )
+
+    def missing(self, texts: List[str]) -> List[str]:
+        return [text for text in texts if text_hash(text) not in self._index]
+
+    def _add(self, texts: List[str], matrices: List[np.ndarray]) -> None:
+        with self._lock:
+            pending = {}
+            for text, m in zip(texts, matrices):
+                key = text_hash(text)
+                if key not in self._index and len(m):
+                    pending[key] = m
+            if not pending:
+                return
+
+            if self._dim is None:
+                self._dim = int(next(iter(pending.values())).shape[1])
+                self._meta_path.write_text(json.dumps({"dim": self._dim}))
+
+            start = self._end
+            records = []
+            with open(self._tokens_path, "ab") as f:
+                # Хвост от оборванной записи (строки без индекса) отрезаем
+                f.truncate(start * 2 * self._dim)
+                for key, m in pending.items():
+                    f.write(np.ascontiguousarray(m, dtype=np.float16).tobytes())
+                    records.append((key, start, len(m)))
+                    start += len(m)
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                for key, begin, count in records:
+                    f.write(
+                        json.dumps({"key": key, "start": begin, "count": count}) + "\n"
+                    )
+
+            # Сначала новые строки, потом ключи: читатель не увидит ключ
+            # без строк
+            self._remap()
+            self._end = start
+            for key, begin, count in records:
+                self._index[key] = (begin, count)
+
+    def _scores(self, query: np.ndarray, texts: List[str]) -> List[Optional[float]]:
+        rows, index = self._rows, self._index
+        found = []
+        for pos, text in enumerate(texts):
+            span = index.get(text_hash(text))
+            if span is not None and rows is not None and sum(span) <= len(rows):
+                found.append((pos, span))
+
+        scores: List[Optional[float]] = [None] * len(texts)
+        if not found:
+            return scores
+
+        tokens = np.concatenate(
+            [rows[start:start + count] for _, (start, count) in found]
+        ).astype(np.float32)
+        values = maxsim(query, tokens, [count for _, (_, count) in found])
+        for (pos, _), value in zip(found, values):
+            scores[pos] = float(value)
+        return scores
+
+    async def add(self, texts: List[str], matrices: List[np.ndarray]) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._pool, self._add, texts, matrices)
+
+    async def scores(self, query: np.ndarray, texts: List[str]) -> List[Optional[float]]:
+        return await asyncio.to_thread(self._scores, query, texts)
+
+    def stats(self) -> Dict:
+        return {
+            "chunks": len(self._index),
+            "tokens": self._end,
+            "dim": self._dim,
+        }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+_token_store: Optional[TokenStore] = None
+
+
+def get_token_store() -> TokenStore:
+    global _token_store
+    if _token_store is None:
+        _token_store = TokenStore(config.token_store_path)
+    return _token_store
+
+
+def close_token_store() -> None:
+    global _token_store
+    if _token_store is not None:
+        _token_store.close()
+        _token_store = None
+
+
+async def index_tokens(texts: List[str]) -> int:
+    """Посчитать и сохранить токенные векторы чанков, которых еще нет."""
+    store = get_token_store()
+    missing = list(dict.fromkeys(store.missing(texts)))
+    if missing:
+        await store.add(missing, await embed_tokens(missing))
+    return len(missing)
+
+
+async def late_interaction_scores(query: str, documents: List[str]) -> List[float]:
+    """
+    Оценки late-interaction реранка: MaxSim токенов запроса по заранее
+    посчитанным токенам чанков. Чанки без токенных векторов (загружены
+    до включения режима) досчитываются и сохраняются на лету.
+    """
+    started = time.perf_counter()
+    store = get_token_store()
+    missing = list(dict.fromkeys(store.missing(documents)))
+
+    embedded = await embed_tokens([query] + missing)
+    if missing:
+        await store.add(missing, embedded[1:])
+
+    scores = await store.scores(embedded[0], documents)
+    if any(score is None for score in scores):
+        raise RuntimeError("Нет токенных векторов для части кандидатов")
+
+    logger.info(
+        "rerank: mode=late docs=%d backfilled=%d took=%.1fms",
+        len(documents),
+        len(missing),
+        (time.perf_counter() - started) * 1000,
+    )
+    return scores
@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import numpy as np
+
+from . import config
+from .benchmark import index_benchmark
+from .quantization import build_codes, top_indices
+from .routing import DEFAULT_PARTITION, partition_of
+from .store import ObjectBatch, VectorStore
+from .vectors import normalize, truncate
+
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Инвертированный индекс поверх нормированных векторов: сферический
+    k-means делит корпус на nlist кластеров, поиск перебирает только
+    nprobe ближайших к запросу кластеров.
+    """
+
+    def __init__(self, vectors: np.ndarray, nlist: int, iterations: int = 10):
+        rng = np.random.default_rng(0)
+        nlist = max(1, min(nlist, len(vectors)))
+        centroids = np.array(
+            vectors[rng.choice(len(vectors), nlist, replace=False)],
+            dtype=np.float32,
+        )
+
+        for _ in range(iterations):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = vectors[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assign == c) for c in range(nlist)]
+        self.built_size = len(vectors)
+
+    def add(self, start: int, vectors: np.ndarray) -> None:
+        """Разложить новые векторы (строки с start) по существующим кластерам."""
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for c in np.unique(assign):
+            rows = start + np.flatnonzero(assign == c)
+            self.lists[c] = np.concatenate([self.lists[c], rows])
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = max(1, min(nprobe, len(self.lists)))
+        nearest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+class LocalStore(VectorStore):
+    """
+    Встроенное хранилище без внешней БД: нормированные float32-векторы
+    подряд в vectors.f32 (дописывается в конец, читается через memmap;
+    размерность — в vectors.json) и метаданные в meta.jsonl,
+    по строке на вектор (текст, источник, курс и все метаданные чанка).
+    Поиск — точный перебор одним матричным умножением или IVF на больших
+    корпусах.
+
+    Первый проход можно удешевить: Matryoshka-усечением до ANN_DIM
+    измерений (усеченная копия живет в памяти) и/или квантованием
+    int8/binary. Тогда полные векторы читаются с диска только для
+    рескоринга шортлиста.
+    """
+
+    backend = "local"
+
+    def __init__(self, path: str):
+        super().__init__(
+            config.local_store_workers, 1, str(Path(path) / "partitions.json")
+        )
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / "vectors.f32"
+        self._dim_path = self.path / "vectors.json"
+        self._meta_path = self.path / "meta.jsonl"
+
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._id_set: Set[str] = set()
+        self._partition_rows: Dict[str, np.ndarray] = {}
+        self._ann: Optional[np.ndarray] = None
+        self._ivf: Optional[IVFIndex] = None
+        self._codes = None
+        self._load()
+
+    def _load(self) -> None:
+        if self._meta_path.exists():
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = [json.loads(line) for line in f if line.strip()]
+        else:
+            meta = []
+
+        rows = 0
+        if self._dim_path.exists() and self._vectors_path.exists():
+            self._dim = json.loads(self._dim_path.read_text())["dim"]
+            rows = self._vectors_path.stat().st_size // (4 * self._dim)
+
+        # После оборванной записи векторов может быть больше, чем метаданных:
+        # число строк задает meta.jsonl, лишний хвост отрежет следующая запись
+        size = min(len(meta), rows)
+        self._vectors = self._map(size)
+        self._ids = [item["id"] for item in meta[:size]]
+        self._texts = [item["text"] for item in meta[:size]]
+        self._id_set = set(self._ids)
+        self._partition_rows = self._group_rows(
+            [item.get("source") or DEFAULT_PARTITION for item in meta[:size]], 0
+        )
+        self._ann = self._build_ann()
+        self._ivf = self._build_ivf()
+        self._codes = self._build_codes()
+
+        # Состояние маршрутизатора отстало от корпуса (например, корпус
+        # загружен до появления партиций) — пересчитываем по векторам
+        if self.partitions.total() != size:
+            self._sync_partitions()
+
+        logger.info("local store: loaded %d vectors from %s", size, self.path)
+
+    def _map(self, rows: int) -> Optional[np.ndarray]:
+        if not rows:
+            return None
+        return np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim)
+        )
+
+    def _group_rows(self, sources: List[str], start: int) -> Dict[str, np.ndarray]:
+        """Номера строк (со сдвигом start) по партициям."""
+        groups: Dict[str, List[int]] = {}
+        for row, source in enumerate(sources, start=start):
+            groups.setdefault(source, []).append(row)
+        return {name: np.asarray(rows, dtype=np.int64) for name, rows in groups.items()}
+
+    def _build_ann(self) -> Optional[np.ndarray]:
+        vectors = self._vectors
+        if vectors is None or not 0 < config.ann_dim < vectors.shape[1]:
+            return None
+        return np.concatenate(
+            [
+                truncate(vectors[i:i + 8192], config.ann_dim)
+                for i in range(0, len(vectors), 8192)
+            ]
+        )
+
+    def _first_stage(self) -> Optional[np.ndarray]:
+        """Векторы первого прохода: усеченные, если задан ANN_DIM, иначе полные."""
+        return self._ann if self._ann is not None else self._vectors
+
+    def _build_ivf(self) -> Optional[IVFIndex]:
+        vectors = self._first_stage()
+        if (
+            config.local_store_index != "ivf"
+            or vectors is None
+            or len(vectors) < config.ivf_min_size
+        ):
+            return None
+        nlist = config.ivf_nlist or int(np.sqrt(len(vectors)))
+        return IVFIndex(np.asarray(vectors), nlist)
+
+    def _build_codes(self):
+        vectors = self._first_stage()
+        if vectors is None or not len(vectors):
+            return None
+        return build_codes(config.local_store_quantization, vectors)
+
+    def _search(
+        self, vector: np.ndarray, limit: int, partition: Optional[str]
+    ) -> List[Dict]:
+        # Снимок ссылок: запись подменяет их целиком, а не меняет на месте
+        vectors, texts = self._vectors, self._texts
+        ann, ivf, codes = self._ann, self._ivf, self._codes
+        if vectors is None or not texts or limit <= 0:
+            return []
+
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        first_query = truncate(query, config.ann_dim) if ann is not None else query
+
+        rows = None
+        if partition is not None:
+            rows = self._partition_rows.get(partition)
+            if rows is None:
+                return []
+            rows = rows[rows < len(vectors)]
+            # Небольшую партицию дешевле перебрать целиком, чем через IVF
+            if ivf is not None and len(rows) >= config.ivf_min_size:
+                rows = np.intersect1d(
+                    rows, ivf.candidates(first_query, config.ivf_nprobe)
+                )
+        elif ivf is not None:
+            rows = ivf.candidates(first_query, config.ivf_nprobe)
+            rows = rows[rows < len(vectors)]
+
+        if codes is not None or ann is not None:
+            size = len(codes.codes) if codes is not None else len(ann)
+            if rows is None:
+                rows = np.arange(min(len(vectors), size))
+            else:
+                rows = rows[rows < size]
+
+            if codes is not None:
+                approx = codes.scores(first_query, rows)
+            else:
+                approx = ann[rows] @ first_query
+            shortlist = top_indices(approx, limit * config.rescore_factor)
+            rows = np.sort(rows[shortlist])
+
+        # Точные скоры по полным векторам: все строки или только шортлист
+        scores = (vectors if rows is None else vectors[rows]) @ query
+        top = top_indices(scores, limit)
+
+        return [
+            {
+                "text": texts[int(rows[i]) if rows is not None else int(i)],
+                "distance": float(1.0 - scores[i]),
+            }
+            for i in top
+        ]
+
+    def _existing_ids(self, uuids: List[str]) -> Set[str]:
+        return self._id_set.intersection(uuids)
+
+    def _add(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        uuids: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        fresh = [
+            i for i, obj_id in enumerate(uuids) if obj_id not in self._id_set
+        ]
+        if not fresh:
+            return
+
+        new = normalize(np.asarray(vectors, dtype=np.float32)[fresh])
+        old = self._vectors
+        start = 0 if old is None else len(old)
+        if self._dim is not None and self._dim != new.shape[1]:
+            raise RuntimeError(
+                f"Размерность векторов {new.shape[1]} не совпадает "
+                f"с хранилищем ({self._dim})"
+            )
+        if self._dim is None:
+            self._dim = int(new.shape[1])
+            self._dim_path.write_text(json.dumps({"dim": self._dim}))
+
+        # Векторы дописываем в конец файла (стоимость записи не растет
+        # с корпусом), метаданные — после: _load не увидит строк без них
+        with open(self._vectors_path, "ab") as f:
+            # Хвост от оборванной записи (строки без метаданных) отрезаем
+            f.truncate(start * 4 * self._dim)
+            f.write(np.ascontiguousarray(new).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(self._meta_path, "a", encoding="utf-8") as f:
+            for i in fresh:
+                f.write(
+                    json.dumps(
+                        {
+                            "id": uuids[i],
+                            "text": texts[i],
+                            "source": partition_of(metadatas[i]),
+                            "course": str(metadatas[i].get("course") or ""),
+                            "metadata": metadatas[i],
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+            f.flush()
+            os.fsync(f.fileno())
+
+        new_ids = [uuids[i] for i in fresh]
+        self._ids = self._ids + new_ids
+        self._texts = self._texts + [texts[i] for i in fresh]
+        self._id_set = self._id_set | set(new_ids)
+        partition_rows = dict(self._partition_rows)
+        for name, rows in self._group_rows(
+            [partition_of(metadatas[i]) for i in fresh], start
+        ).items():
+            if name in partition_rows:
+                rows = np.concatenate([partition_rows[name], rows])
+            partition_rows[name] = rows
+        self._partition_rows = partition_rows
+
+        ivf = self._ivf
+        self._vectors = self._map(start + len(new))
+        if self._ann is not None:
+            first_new = truncate(new, config.ann_dim)
+            self._ann = np.concatenate([self._ann, first_new])
+        else:
+            if old is None:
+                self._ann = self._build_ann()
+            first_new = new if self._ann is None else self._ann[start:]
+        if ivf is not None and len(self._vectors) < 2 * ivf.built_size:
+            ivf.add(start, first_new)
+        else:
+            # Корпус вырос вдвое (или индекса еще не было) — перестраиваем
+            self._ivf = self._build_ivf()
+
+        if self._codes is not None and len(self._vectors) < 2 * start:
+            self._codes.add(first_new)
+        else:
+            # Параметры квантования обучаем заново на выросшем корпусе
+            self._codes = self._build_codes()
+
+    def _count(self) -> int:
+        return len(self._ids)
+
+    def _sync_partitions(self) -> None:
+        vectors, partition_rows = self._vectors, self._partition_rows
+        self.partitions.reset(
+            {
+                name: np.asarray(vectors[rows].sum(axis=0))
+                for name, rows in partition_rows.items()
+            },
+            {name: len(rows) for name, rows in partition_rows.items()},
+        )
+
+    def _iter_objects(self, batch_size: int) -> Iterator[ObjectBatch]:
+        vectors, size = self._vectors, len(self._ids)
+        if vectors is None or not size:
+            return
+        with open(self._meta_path, encoding="utf-8") as f:
+            items = (json.loads(line) for line in f if line.strip())
+            for start in range(0, size, batch_size):
+                batch = list(islice(items, min(batch_size, size - start)))
+                yield (
+                    [item["id"] for item in batch],
+                    [item["text"] for item in batch],
+                    [self._metadata(item) for item in batch],
+                    np.array(vectors[start:start + len(batch)], dtype=np.float32),
+                )
+
+    @staticmethod
+    def _metadata(item: Dict[str, Any]) -> Dict[str, Any]:
+        if "metadata" in item:
+            return item["metadata"] or {}
+        # Строки, записанные до появления поля metadata
+        return {
+            key: item[key] for key in ("source", "course") if item.get(key)
+        }
+
+    def _debug(self) -> dict:
+        vectors = self._vectors
+        return {
+            "backend": self.backend,
+            "path": str(self.path),
+            "count": len(self._texts),
+            "partitions": {
+                name: len(rows) for name, rows in self._partition_rows.items()
+            },
+            "dim": None if vectors is None else int(vectors.shape[1]),
+            "index": "ivf" if self._ivf is not None else "flat",
+            "ann_dim": None if self._ann is None else int(self._ann.shape[1]),
+            "nlist": None if self._ivf is None else len(self._ivf.lists),
+            "quantization": self._codes.mode if self._codes is not None else "none",
+            "vectors_bytes": 0 if vectors is None else int(vectors.nbytes),
+            "codes_bytes": 0 if self._codes is None else int(self._codes.nbytes),
+        }
+
+    def _benchmark_index(self, k: int, samples: int) -> List[Dict]:
+        if self._vectors is None or len(self._vectors) <= k:
+            return []
+        return index_benchmark(
+            self._vectors, k, samples, config.rescore_factor
+        )
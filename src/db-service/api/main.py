@@ -1,11 +1,47 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 import uvicorn
 
-from .routers import router
+from . import config
+from .cache import close_caches, init_caches
+from .clients import close_http_clients, init_http_clients
+from .routers import ingest_manager, router, store
+from .late_interaction import close_token_store
+from .shortcut import get_question_index
+from .utils import close_batchers
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_http_clients()
+    init_caches()
+    if config.question_shortcut:
+        get_question_index()
+    # Не ждем хранилище: сервис стартует сразу, готовность видна в /ready
+    connect_task = asyncio.create_task(store.connect())
+
+    yield
+
+    connect_task.cancel()
+    await ingest_manager.close()
+    await close_batchers()
+    await close_http_clients()
+    await close_caches()
+    close_token_store()
+    store.close()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -14,4 +50,4 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-app.include_router(router)
\ No newline at end of file
+app.include_router(router)
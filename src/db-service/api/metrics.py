@@ -0,0 +1,100 @@
+from typing import Dict
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .cache import cache_stats
+
+
+STAGE_SECONDS = Histogram(
+    "db_retrieve_stage_seconds",
+    "Длительность этапов /retrieve",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+PARTITION_SECONDS = Histogram(
+    "db_partition_search_seconds",
+    "Длительность поиска по партиции",
+    ["partition"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CANDIDATES = Histogram(
+    "db_retrieve_candidates",
+    "Число кандидатов: найдено в хранилище и оставлено для реранка",
+    ["kind"],
+    buckets=(0, 1, 2, 5, 10, 15, 20, 30, 50, 100),
+)
+BATCH_SIZE = Histogram(
+    "db_batcher_batch_size",
+    "Размер батчей микробатчера (элементов за вызов бэкенда)",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+BATCH_WAIT = Histogram(
+    "db_batcher_wait_seconds",
+    "Сколько запрос ждал в очереди микробатчера",
+    ["batcher"],
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1),
+)
+DEGRADED = Counter(
+    "db_retrieve_degraded_total",
+    "Ответы /retrieve по уровню деградации реранка",
+    ["level"],
+)
+SHORTCUT = Counter(
+    "db_question_shortcut_total",
+    "Быстрые ответы по каноническим вопросам: exact, fuzzy или miss",
+    ["result"],
+)
+ERRORS = Counter(
+    "db_errors_total",
+    "Ошибки по этапам пайплайна",
+    ["stage"],
+)
+
+
+def observe_timings(timings: Dict[str, float]) -> None:
+    """Записать тайминги этапов (в мс) в гистограммы."""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.labels(stage).observe(ms / 1000)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Значение заголовка Server-Timing: embed;dur=12.3, search;dur=4.5, ..."""
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+
+class CacheCollector:
+    """Счетчики кэшей читаются из cache_stats() в момент скрейпа."""
+
+    def collect(self):
+        try:
+            stats = cache_stats()
+        except RuntimeError:
+            # Кэши еще не инициализированы
+            return
+
+        lru = {
+            "embeddings": stats["embeddings"]["local"],
+            "results": stats["results"],
+            "scores": stats["scores"],
+        }
+        for kind in ("hits", "misses", "evictions"):
+            family = CounterMetricFamily(
+                f"db_cache_{kind}", f"Кэши: {kind}", labels=["cache"]
+            )
+            for name, values in lru.items():
+                family.add_metric([name], values[kind])
+            if kind != "evictions":
+                family.add_metric(
+                    ["embeddings_redis"], stats["embeddings"]["redis"][kind]
+                )
+            yield family
+
+        size = GaugeMetricFamily("db_cache_size", "Кэши: записей", labels=["cache"])
+        for name, values in lru.items():
+            size.add_metric([name], values["size"])
+        yield size
+
+
+REGISTRY.register(CacheCollector())
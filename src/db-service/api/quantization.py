@@ -0,0 +1,114 @@
+from typing import Optional
+
+import numpy as np
+
+
+# Сколько строк кодировать/скорить за раз, чтобы не поднимать весь memmap
+CHUNK_ROWS = 8192
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k наибольших значений, по убыванию."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class Int8Codes:
+    """
+    Скалярное квантование: каждое измерение линейно отображается
+    в uint8 по min/max корпуса на момент построения. Скор
+    q·x ≈ (q * scale)·codes + q·lo считается без распаковки кодов.
+    """
+
+    mode = "int8"
+
+    def __init__(self, vectors: np.ndarray):
+        self.lo = np.asarray(vectors.min(axis=0), dtype=np.float32)
+        hi = np.asarray(vectors.max(axis=0), dtype=np.float32)
+        self.scale = np.maximum(hi - self.lo, 1e-12) / 255.0
+        self.codes = self._encode_all(vectors)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors) - self.lo) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _encode_all(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [
+                self._encode(vectors[i:i + CHUNK_ROWS])
+                for i in range(0, len(vectors), CHUNK_ROWS)
+            ]
+        )
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.codes = np.concatenate([self.codes, self._encode_all(vectors)])
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        q_scaled = (query * self.scale).astype(np.float32)
+        offset = float(query @ self.lo)
+        return np.concatenate(
+            [
+                codes[i:i + CHUNK_ROWS].astype(np.float32) @ q_scaled
+                for i in range(0, len(codes), CHUNK_ROWS)
+            ]
+        ) + offset
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.lo.nbytes + self.scale.nbytes
+
+
+class BinaryCodes:
+    """
+    Бинарное квантование: знак каждого измерения в одном бите.
+    Близость — минус расстояние Хэмминга между кодами.
+    """
+
+    mode = "binary"
+
+    def __init__(self, vectors: np.ndarray):
+        self.codes = self._encode_all(vectors)
+
+    @staticmethod
+    def _encode(vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+    def _encode_all(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [
+                self._encode(vectors[i:i + CHUNK_ROWS])
+                for i in range(0, len(vectors), CHUNK_ROWS)
+            ]
+        )
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.codes = np.concatenate([self.codes, self._encode_all(vectors)])
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        q_bits = self._encode(query)
+        return -np.concatenate(
+            [
+                _POPCOUNT[codes[i:i + CHUNK_ROWS] ^ q_bits].sum(axis=1)
+                for i in range(0, len(codes), CHUNK_ROWS)
+            ]
+        ).astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+def build_codes(mode: str, vectors: np.ndarray):
+    """Квантованные коды для режима none/int8/binary (None — без квантования)."""
+    if mode == "int8":
+        return Int8Codes(vectors)
+    if mode == "binary":
+        return BinaryCodes(vectors)
+    return None
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .cache import get_result_cache
+from .candidates import (
+    collapse_duplicates,
+    select_candidates,
+    shortlist_candidates,
+)
+from .metrics import (
+    CANDIDATES,
+    DEGRADED,
+    ERRORS,
+    PARTITION_SECONDS,
+    SHORTCUT,
+    observe_timings,
+)
+from .shortcut import get_question_index
+from .store import VectorStore
+from .utils import chunk_uuid, embed_query, rerank_with_deadline
+
+
+logger = logging.getLogger(__name__)
+
+
+def _ms(start: float, end: float) -> float:
+    return round((end - start) * 1000, 1)
+
+
+async def search_partitions(
+    store: VectorStore,
+    query_vec: np.ndarray,
+    limit: int,
+    partitions: Optional[List[str]],
+) -> List[Dict]:
+    """
+    Поиск только в заданных партициях: параллельно по каждой, результаты
+    сливаются по дистанции. Без партиций — поиск по всему корпусу.
+    """
+    if not partitions:
+        return await store.search(query_vec, limit)
+
+    async def search_one(partition: str) -> List[Dict]:
+        started = time.perf_counter()
+        found = await store.search(query_vec, limit, partition)
+        PARTITION_SECONDS.labels(partition).observe(time.perf_counter() - started)
+        return found
+
+    results = await asyncio.gather(*(search_one(p) for p in partitions))
+    merged = [item for found in results for item in found]
+    merged.sort(
+        key=lambda c: c["distance"] if c.get("distance") is not None else float("inf")
+    )
+    return merged[:limit]
+
+
+async def retrieve_texts(
+    store: VectorStore,
+    text: str,
+    top_k: int,
+    query_vec: Optional[np.ndarray] = None,
+    budget_ms: Optional[float] = None,
+) -> Tuple[List[str], Dict[str, float], Optional[str]]:
+    """
+    Полный пайплайн поиска: канонический вопрос -> кэш результатов ->
+    эмбеддинг запроса -> поиск кандидатов -> реранк. Если query_vec уже
+    посчитан, шаг эмбеддинга пропускается.
+
+    budget_ms — бюджет времени на весь запрос (None — из конфига,
+    0 — без ограничения). Реранку достается остаток бюджета; если он
+    не укладывается, результат деградирует (см. rerank_with_deadline)
+    и не кэшируется.
+
+    Возвращает (тексты, тайминги этапов в мс, деградация). Ошибки любого
+    этапа поднимаются как RuntimeError с описанием этапа.
+    """
+    started = time.perf_counter()
+    if budget_ms is None:
+        budget_ms = config.retrieve_budget_ms
+
+    if config.question_shortcut:
+        index = get_question_index()
+        hit = index.lookup(text)
+        if hit is not None and not await store.existing_ids([chunk_uuid(hit[0])]):
+            # Чанка с ответом нет в коллекции (ее пересоздали или очистили):
+            # этот запрос идет обычным поиском, а запись индекса остается —
+            # повторная загрузка корпуса вернет чанк
+            hit = None
+        result = hit[1] if hit else "miss"
+        index.record(result)
+        SHORTCUT.labels(result).inc()
+        if hit is not None:
+            timings = {"shortcut": _ms(started, time.perf_counter())}
+            timings["total"] = timings["shortcut"]
+            observe_timings(timings)
+            return [hit[0]], timings, None
+
+    result_cache = get_result_cache()
+    corpus_version = result_cache.corpus_version
+    cached = result_cache.get(text, top_k)
+    if cached is not None:
+        timings = {"cache": _ms(started, time.perf_counter())}
+        timings["total"] = timings["cache"]
+        observe_timings(timings)
+        return cached, timings, None
+
+    timings: Dict[str, float] = {}
+
+    if query_vec is None:
+        try:
+            query_vec = await embed_query(text)
+        except Exception:
+            ERRORS.labels("embed").inc()
+            raise
+        embedded_at = time.perf_counter()
+        timings["embed"] = _ms(started, embedded_at)
+    else:
+        embedded_at = started
+
+    try:
+        partitions = (
+            store.partitions.route(query_vec) if config.partition_routing else None
+        )
+        found = await search_partitions(
+            store, query_vec, config.candidate_limit, partitions
+        )
+    except Exception as e:
+        ERRORS.labels("search").inc()
+        raise RuntimeError(f"Ошибка поиска в хранилище: {e}")
+    searched_at = time.perf_counter()
+    timings["search"] = _ms(embedded_at, searched_at)
+
+    CANDIDATES.labels("fetched").observe(len(found))
+    if not found:
+        timings["total"] = _ms(started, searched_at)
+        observe_timings(timings)
+        return [], timings, None
+
+    selected = collapse_duplicates(select_candidates(found, top_k))
+    if config.rerank_shortlist > 0:
+        selected = shortlist_candidates(
+            text, selected, max(config.rerank_shortlist, top_k)
+        )
+    candidates = [c["text"] for c in selected]
+    CANDIDATES.labels("reranked").observe(len(candidates))
+
+    timeout = None
+    if budget_ms > 0:
+        timeout = budget_ms / 1000 - (time.perf_counter() - started)
+
+    try:
+        ranked, degraded = await rerank_with_deadline(
+            text, candidates, top_k=top_k, timeout=timeout
+        )
+    except Exception:
+        ERRORS.labels("rerank").inc()
+        raise
+    reranked_at = time.perf_counter()
+    timings["rerank"] = _ms(searched_at, reranked_at)
+    timings["total"] = _ms(started, reranked_at)
+    observe_timings(timings)
+    DEGRADED.labels(degraded or "none").inc()
+
+    logger.info(
+        "retrieve: %s",
+        " ".join(f"{stage}={ms}ms" for stage, ms in timings.items()),
+    )
+
+    # Схлопнутые группы раскрываются в склеенный контекст
+    result = [
+        selected[item["index"]].get("context", candidates[item["index"]])
+        for item in ranked
+    ]
+    if degraded is None:
+        result_cache.set(text, top_k, result, corpus_version)
+
+    return result, timings, degraded
@@ -1,116 +1,334 @@
+import asyncio
 import logging
-import uuid
-import os
-import uuid
+import time
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException
-from weaviate import Client
+import numpy as np
+from fastapi import APIRouter, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from .utils import ensure_schema, embed_texts, rerank
-from .schemas import Chunks, StatusResponse, SearchQuery
+from . import config
+from .benchmark import cascade_benchmark, rerank_benchmark, routing_benchmark
+from .store import create_store
+from .cache import cache_stats, get_result_cache
+from .metrics import ERRORS, server_timing
+from .retrieval import retrieve_texts
+from .ingest import IngestManager, index_chunk_tokens, select_new_chunks
+from .utils import embed_queries, embed_texts, ping_embedder
+from .shortcut import get_question_index, index_questions
+from .snapshot import export_snapshot, import_snapshot
+from .schemas import (
+    BatchChunks,
+    BatchResult,
+    BatchSearchQuery,
+    CascadeBenchmarkQuery,
+    Chunks,
+    IngestJobStatus,
+    RerankBenchmarkQuery,
+    RoutingBenchmarkQuery,
+    StatusResponse,
+    SearchQuery,
+    SearchResult,
+    SnapshotRequest,
+)
 
 
-db_url = os.getenv("WEAVIATE_URL")
-client = Client(db_url)
-ensure_schema(client, "doc")
+logger = logging.getLogger(__name__)
+
+store = create_store()
+ingest_manager = IngestManager(store)
 
 router = APIRouter()
 
 
-@router.post("/add_chunks", response_model=StatusResponse)
-async def add_chunks(chunks: Chunks) -> StatusResponse:
+def _check_chunks(chunks: Chunks) -> None:
     if not chunks.texts:
         raise HTTPException(status_code=400, detail="chunks is empty")
+    if chunks.metadatas is not None and len(chunks.metadatas) != len(chunks.texts):
+        raise HTTPException(
+            status_code=400,
+            detail="Количество метаданных не совпадает с количеством чанков",
+        )
+
+
+@router.post("/add_chunks", response_model=StatusResponse)
+async def add_chunks(chunks: Chunks) -> StatusResponse:
+    _check_chunks(chunks)
+
+    try:
+        uuids, texts, metadatas = await select_new_chunks(
+            store, chunks.texts, chunks.metadatas
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Ошибка поиска в хранилище: {e}"
+        )
+
+    skipped = len(chunks.texts) - len(texts)
+
+    if not texts:
+        await index_questions(chunks.texts, chunks.metadatas)
+        return StatusResponse(status="OK", added=0, skipped=skipped)
 
     try:
-        vectors = await embed_texts(chunks.texts)
+        vectors = await embed_texts(texts)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    if len(vectors) != len(chunks.texts):
+    if len(vectors) != len(texts):
         raise HTTPException(
             status_code=500,
             detail="Количество эмбеддингов не совпадает с количеством чанков",
         )
 
+    await index_chunk_tokens(texts)
+
     try:
-        with client.batch(batch_size=100) as batch:
-            for text, vector in zip(chunks.texts, vectors):
-                batch.add_data_object(
-                    data_object={"text": text},
-                    class_name="doc",
-                    uuid=str(uuid.uuid4()),
-                    vector=vector,
-                )
+        await store.add(texts, vectors, uuids, metadatas)
     except Exception as e:
         raise HTTPException(
-            status_code=500, detail=f"Ошибка записи в Weaviate: {e}"
+            status_code=500, detail=f"Ошибка записи в хранилище: {e}"
         )
+    finally:
+        # Даже частичная запись меняет корпус
+        get_result_cache().bump_version()
+
+    # Вопросы индексируются только после записи (иначе быстрый ответ
+    # укажет на чанк, которого еще нет) и для уже загруженных чанков:
+    # повторная загрузка корпуса достраивает индекс
+    await index_questions(chunks.texts, chunks.metadatas)
 
-    return StatusResponse(status="OK")
+    logger.info("add_chunks: added=%d skipped=%d", len(texts), skipped)
+    return StatusResponse(status="OK", added=len(texts), skipped=skipped)
 
 
-@router.post("/retrieve", response_model=Chunks)
-async def retrieve(query: SearchQuery) -> Chunks:
+@router.post("/ingest_jobs", response_model=IngestJobStatus)
+async def submit_ingest_job(chunks: Chunks) -> IngestJobStatus:
+    """Поставить чанки в фоновую индексацию, прогресс — GET /ingest_jobs/{id}."""
+    _check_chunks(chunks)
+    return ingest_manager.submit(chunks.texts, chunks.metadatas)
+
+
+@router.get("/ingest_jobs/{job_id}", response_model=IngestJobStatus)
+async def get_ingest_job(job_id: str) -> IngestJobStatus:
+    status = ingest_manager.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return status
+
+
+@router.post("/retrieve", response_model=SearchResult)
+async def retrieve(query: SearchQuery, response: Response) -> SearchResult:
     if not query.text:
         raise HTTPException(status_code=400, detail="query is empty")
 
     top_k = max(1, query.top_k)
 
     try:
-        embedded = await embed_texts([query.text])
-        query_vec = embedded[0]
+        texts, timings, degraded = await retrieve_texts(
+            store, query.text, top_k, budget_ms=query.budget_ms
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    response.headers["Server-Timing"] = server_timing(timings)
+    return SearchResult(texts=texts, degraded=degraded)
+
+
+@router.post("/retrieve_batch", response_model=BatchChunks)
+async def retrieve_batch(query: BatchSearchQuery) -> BatchChunks:
+    """
+    Поиск по нескольким запросам: эмбеддинг всех запросов одним вызовом,
+    поиск и реранк параллельно, результаты в порядке запросов.
+    """
+    if not query.texts or not all(query.texts):
+        raise HTTPException(status_code=400, detail="query is empty")
+
+    top_k = max(1, query.top_k)
+
+    started = time.perf_counter()
+    # Канонические вопросы отвечаются без эмбеддинга
+    to_embed = [
+        text for text in query.texts
+        if not (config.question_shortcut and get_question_index().lookup(text))
+    ]
     try:
-        near_vector = {"vector": query_vec}
-        res = (
-            client.query.get("doc", ["text"])
-            .with_near_vector(near_vector)
-            .with_limit(30)
-            .do()
-        )
-        objects = res["data"]["Get"].get("Doc", [])
-        candidates = [obj["text"] for obj in objects]
+        vectors = dict(zip(to_embed, await embed_queries(to_embed)))
     except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Ошибка поиска в Weaviate: {e}"
+        ERRORS.labels("embed").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+    embed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    semaphore = asyncio.Semaphore(max(1, config.retrieve_batch_concurrency))
+    budget_ms = (
+        query.budget_ms if query.budget_ms is not None
+        else config.retrieve_budget_ms
+    )
+
+    async def retrieve_one(text: str, vector: Optional[np.ndarray]) -> BatchResult:
+        async with semaphore:
+            # Бюджет у каждого запроса свой и отсчитывается с начала его
+            # обработки, а не батча: ожидание в очереди семафора не
+            # съедает его. Общий эмбеддинг входит в бюджет, как в /retrieve.
+            # 0 передаем явно — None означало бы бюджет из конфига
+            remaining = 0.0
+            if budget_ms > 0:
+                spent_ms = embed_ms if vector is not None else 0.0
+                remaining = max(budget_ms - spent_ms, 1e-3)
+            try:
+                texts, timings, degraded = await retrieve_texts(
+                    store, text, top_k, vector, budget_ms=remaining
+                )
+            except Exception as e:
+                return BatchResult(texts=[], error=str(e))
+        if vector is not None:
+            timings = {"embed": embed_ms, **timings}
+        return BatchResult(texts=texts, timings=timings, degraded=degraded)
+
+    results = await asyncio.gather(
+        *(retrieve_one(text, vectors.get(text)) for text in query.texts)
+    )
+    logger.info(
+        "retrieve_batch: queries=%d took=%.1fms",
+        len(query.texts),
+        (time.perf_counter() - started) * 1000,
+    )
+    return BatchChunks(results=list(results))
+
+
+async def _check(ping) -> dict:
+    started = time.perf_counter()
+    try:
+        await ping
+        result = {"ready": True}
+    except Exception as e:
+        result = {"ready": False, "error": str(e) or type(e).__name__}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+@router.get("/ready")
+async def ready(response: Response):
+    """
+    Готовность к трафику: доступны ли хранилище и эмбеддер и за сколько
+    они отвечают. 503, пока хотя бы одна зависимость не готова.
+    """
+    store_check, embedder_check = await asyncio.gather(
+        _check(store.ping()), _check(ping_embedder())
+    )
+    is_ready = store_check["ready"] and embedder_check["ready"]
+    if not is_ready:
+        response.status_code = 503
+    return {
+        "ready": is_ready,
+        "store": {"backend": store.backend, **store_check},
+        "embedder": embedder_check,
+    }
+
+
+@router.get("/metrics")
+async def metrics() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/cache_stats")
+async def get_cache_stats():
+    return {**cache_stats(), "questions": get_question_index().stats()}
+
+
+@router.get("/partitions")
+async def get_partitions():
+    """
+    Партиции корпуса: число чанков и сколько раз в них маршрутизировались
+    запросы.
+    """
+    return store.partitions.stats()
+
+
+@router.post("/partitions/sync")
+async def sync_partitions():
+    """
+    Сверить партиции с коллекцией и при расхождении пересчитать их
+    полным проходом по коллекции (например, после перезаливки корпуса
+    в обход сервиса).
+    """
+    try:
+        rebuilt = await store.sync_partitions()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Store error: {e}")
+    return {"rebuilt": rebuilt, "partitions": store.partitions.stats()}
+
+
+@router.get("/benchmark/index")
+async def benchmark_index(k: int = 10, samples: int = 100):
+    try:
+        return await store.benchmark_index(max(1, k), max(1, samples))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/benchmark/cascade")
+async def benchmark_cascade(query: CascadeBenchmarkQuery):
+    if not query.texts:
+        raise HTTPException(status_code=400, detail="Нужен хотя бы один запрос")
+    try:
+        return await cascade_benchmark(
+            store, query.texts, max(1, query.top_k), query.sizes
         )
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/benchmark/rerank")
+async def benchmark_rerank(query: RerankBenchmarkQuery):
+    if not query.texts:
+        raise HTTPException(status_code=400, detail="Нужен хотя бы один запрос")
+    try:
+        return await rerank_benchmark(store, query.texts, max(1, query.top_k))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-    if not candidates:
-        return Chunks(texts=[])
 
+@router.post("/benchmark/routing")
+async def benchmark_routing(query: RoutingBenchmarkQuery):
+    if not query.texts:
+        raise HTTPException(status_code=400, detail="Нужен хотя бы один запрос")
     try:
-        ranked = await rerank(query.text, candidates, top_k=top_k)
+        return await routing_benchmark(store, query.texts, max(1, query.top_k))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/snapshot/export")
+async def snapshot_export(request: SnapshotRequest):
+    """Выгрузить векторы, тексты и метаданные коллекции в снапшот name."""
+    try:
+        return await export_snapshot(store, request.name)
+    except (NotImplementedError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        logger.exception("snapshot export failed")
         raise HTTPException(status_code=500, detail=str(e))
 
-    result = [
-        candidates[item["index"]]
-        for item in ranked
-    ]
 
-    return Chunks(texts=result)
+@router.post("/snapshot/import")
+async def snapshot_import(request: SnapshotRequest):
+    """Загрузить снапшот в коллекцию без повторного эмбеддинга."""
+    try:
+        return await import_snapshot(store, request.name)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("snapshot import failed")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/debug")
 async def debug():
 
     try:
-        schema = client.schema.get()
-        agg = client.query.aggregate("doc").with_meta_count().do()
+        return await store.debug()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Weaviate error: {e}")
-
-    return Response(
-        content=json.dumps(
-            {
-                "schema": schema,
-                "aggregate_doc": agg,
-            },
-            ensure_ascii=False,
-            indent=2,
-        ),
-        media_type="application/json",
-    )
+        raise HTTPException(status_code=500, detail=f"Store error: {e}")
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .vectors import normalize
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "default"
+
+
+def partition_of(metadata: Optional[Dict[str, Any]]) -> str:
+    """Партиция чанка: источник корпуса из метаданных (поле source)."""
+    return str((metadata or {}).get("source") or DEFAULT_PARTITION)
+
+
+class PartitionRouter:
+    """
+    Маршрутизатор запросов по тематическим партициям: для каждой партиции
+    хранится сумма нормированных векторов ее чанков, запрос уходит в
+    партиции с ближайшими центроидами. Состояние — небольшой JSON рядом
+    с хранилищем.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._counts: Dict[str, int] = {}
+        self._sums: Dict[str, np.ndarray] = {}
+        # (имена, центроиды) подменяются одной ссылкой
+        self._routing: Tuple[List[str], Optional[np.ndarray]] = ([], None)
+        self._lock = threading.Lock()
+        self.routed: Counter = Counter()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        state = json.loads(self.path.read_text(encoding="utf-8"))
+        for name, item in state.items():
+            self._counts[name] = item["count"]
+            self._sums[name] = np.asarray(item["sum"], dtype=np.float32)
+        self._rebuild()
+        logger.info("partitions: loaded %s", self._counts)
+
+    def _rebuild(self) -> None:
+        names = sorted(self._sums)
+        centroids = (
+            normalize(np.stack([self._sums[name] for name in names]))
+            if names else None
+        )
+        self._routing = (names, centroids)
+
+    def total(self) -> int:
+        return sum(self._counts.values())
+
+    def reset(self, sums: Dict[str, np.ndarray], counts: Dict[str, int]) -> None:
+        """Заменить состояние целиком (пересчет по всему корпусу)."""
+        with self._lock:
+            self._sums = dict(sums)
+            self._counts = dict(counts)
+            self._rebuild()
+            self._save()
+
+    def add(self, partitions: List[str], vectors: np.ndarray) -> None:
+        """Учесть новые чанки: партиции и векторы в одном порядке."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            for name in set(partitions):
+                rows = [i for i, p in enumerate(partitions) if p == name]
+                total = vectors[rows].sum(axis=0)
+                if name in self._sums:
+                    self._sums[name] = self._sums[name] + total
+                else:
+                    self._sums[name] = total
+                self._counts[name] = self._counts.get(name, 0) + len(rows)
+            self._rebuild()
+            self._save()
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    name: {"count": self._counts[name], "sum": self._sums[name].tolist()}
+                    for name in self._sums
+                }
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp_path, self.path)
+
+    def route(self, vector: np.ndarray, record: bool = True) -> Optional[List[str]]:
+        """
+        Партиции для поиска: ближайшая по центроиду и те, что отстают от нее
+        не больше чем на router_margin, всего не больше router_max_partitions.
+        None — искать по всему корпусу (партиций меньше двух). record=False —
+        не учитывать запрос в статистике (бенчмарк).
+        """
+        names, centroids = self._routing
+        if centroids is None or len(names) < 2:
+            return None
+
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        if query.shape[-1] != centroids.shape[1]:
+            return None
+        scores = centroids @ query
+        order = np.argsort(-scores)[: max(1, config.router_max_partitions)]
+        best = scores[order[0]]
+        chosen = [names[i] for i in order if scores[i] >= best - config.router_margin]
+        if record:
+            self.routed.update(chosen)
+        return chosen
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"chunks": self._counts[name], "routed": self.routed[name]}
+            for name in self._routing[0]
+        }
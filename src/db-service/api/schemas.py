@@ -1,13 +1,62 @@
-from typing import List, Literal
+from typing import Any, Dict, List, Literal, Optional
 from pydantic import BaseModel
 
 
 class Chunks(BaseModel):
     texts: List[str]
+    metadatas: Optional[List[Dict[str, Any]]] = None
 
 class StatusResponse(BaseModel):
     status: Literal["OK", "ERROR"]
+    added: Optional[int] = None
+    skipped: Optional[int] = None
 
 class SearchQuery(BaseModel):
-    query: str
+    text: str
     top_k: int = 5
+    budget_ms: Optional[float] = None
+
+class SearchResult(BaseModel):
+    texts: List[str]
+    degraded: Optional[Literal["partial", "vector"]] = None
+
+class IngestJobStatus(BaseModel):
+    job_id: str
+    status: Literal["pending", "running", "done", "failed"]
+    total: int
+    added: int = 0
+    skipped: int = 0
+    failed: int = 0
+    batches_total: int = 0
+    batches_done: int = 0
+    errors: List[str] = []
+
+class BatchSearchQuery(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+    budget_ms: Optional[float] = None
+
+class BatchResult(BaseModel):
+    texts: List[str]
+    timings: Dict[str, float] = {}
+    degraded: Optional[Literal["partial", "vector"]] = None
+    error: Optional[str] = None
+
+class BatchChunks(BaseModel):
+    results: List[BatchResult]
+
+class CascadeBenchmarkQuery(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+    sizes: List[int] = [5, 10, 15]
+
+class RerankBenchmarkQuery(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+
+class RoutingBenchmarkQuery(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+
+class SnapshotRequest(BaseModel):
+    name: str = "latest"
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_question(text: str) -> str:
+    """Каноничный вид вопроса: регистр, пунктуация, пробелы и ё не важны."""
+    text = text.lower().replace("ё", "е")
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Насколько похожими должны быть слова, чтобы считаться опечаткой
+_TYPO_RATIO = 0.8
+
+
+def _same_words(query: str, question: str) -> bool:
+    """
+    Вопросы различаются только опечатками: у каждого слова, которого нет
+    в другом вопросе, там есть похожая пара. Лишнее слово без пары
+    (например, «не») меняет смысл, хотя триграммы почти совпадают.
+    """
+    left, right = set(query.split()), set(question.split())
+    only_left, only_right = left - right, right - left
+    for words, others in ((only_left, only_right), (only_right, only_left)):
+        for word in words:
+            if not any(
+                SequenceMatcher(None, word, other).ratio() >= _TYPO_RATIO
+                for other in others
+            ):
+                return False
+    return True
+
+
+class QuestionIndex:
+    """
+    Индекс канонических вопросов Q&A-корпусов (поле question в метаданных):
+    точное совпадение нормализованного вопроса — по хэш-таблице, нечеткое
+    (если включено) — по символьным триграммам (коэффициент Дайса) с
+    проверкой, что вопросы различаются только опечатками.
+
+    Ответы хранятся по источникам: повторная загрузка вопроса из того же
+    источника заменяет его ответы. Вопрос с несколькими разными ответами
+    (общие формулировки вроде «Что будет напечатано?») неоднозначен —
+    по нему быстрого ответа нет, работает обычный поиск. Записи
+    {вопрос, источник, ответы} дописываются в JSONL, актуальна последняя.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._sources: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+        # Ответы вопроса по всем источникам; читается без блокировки
+        self._answers: Dict[str, Tuple[str, ...]] = {}
+        self._questions: List[str] = []
+        self._sizes: List[int] = []
+        self._grams: Dict[str, List[int]] = {}
+        self._indexed: Set[str] = set()
+        self._records = 0
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    self._set(item["question"], item["source"], tuple(item["texts"]))
+                    self._records += 1
+
+        entries = sum(len(sources) for sources in self._sources.values())
+        if self._records > entries:
+            self._compact()
+        logger.info(
+            "question index: loaded %d questions from %s",
+            len(self._answers),
+            self.path,
+        )
+
+    def _compact(self) -> None:
+        """Переписать JSONL без замененных записей."""
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for question, sources in self._sources.items():
+                for source, texts in sources.items():
+                    f.write(self._record(question, source, texts))
+        os.replace(tmp_path, self.path)
+        self._records = sum(len(sources) for sources in self._sources.values())
+
+    @staticmethod
+    def _record(question: str, source: str, texts: Tuple[str, ...]) -> str:
+        return (
+            json.dumps(
+                {"question": question, "source": source, "texts": list(texts)},
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+
+    def _set(self, question: str, source: str, texts: Tuple[str, ...]) -> bool:
+        """Заменить ответы вопроса из источника. False — ничего не изменилось."""
+        sources = self._sources.get(question, {})
+        if sources.get(source, ()) == texts:
+            return False
+        sources = {**sources, source: texts}
+        if not texts:
+            del sources[source]
+        self._sources[question] = sources
+
+        if question not in self._indexed:
+            # Триграммы заводятся один раз на вопрос
+            grams = _trigrams(question)
+            idx = len(self._questions)
+            self._questions.append(question)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(idx)
+            self._indexed.add(question)
+
+        # Порядок важен для читателей без блокировки: ответы обновляются
+        # последними, когда триграммы уже на месте
+        answers = tuple(dict.fromkeys(t for ts in sources.values() for t in ts))
+        if answers:
+            self._answers[question] = answers
+        else:
+            self._answers.pop(question, None)
+        return True
+
+    def _update(self, entries: List[Tuple[str, str, Tuple[str, ...]]]) -> int:
+        with self._lock:
+            changed = [entry for entry in entries if self._set(*entry)]
+            if changed:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for entry in changed:
+                        f.write(self._record(*entry))
+                self._records += len(changed)
+        return len(changed)
+
+    async def add(self, items: List[Tuple[str, str, str]]) -> int:
+        """
+        Добавить тройки (вопрос, источник, чанк с ответом). Ответы вопроса
+        из этого источника заменяются пришедшими; возвращает, сколько
+        пар вопрос/источник изменилось.
+        """
+        grouped: Dict[Tuple[str, str], List[str]] = {}
+        for question, source, text in items:
+            question = normalize_question(question)
+            if question:
+                grouped.setdefault((question, source), []).append(text)
+        entries = [
+            (question, source, tuple(dict.fromkeys(texts)))
+            for (question, source), texts in grouped.items()
+        ]
+        return await asyncio.to_thread(self._update, entries)
+
+    def lookup(self, query: str) -> Optional[Tuple[str, str, str]]:
+        """
+        Чанк с ответом на канонический вопрос: (текст, "exact" | "fuzzy",
+        вопрос из индекса) или None — вопрос не найден, неоднозначен или
+        сходство ниже question_shortcut_threshold.
+        """
+        question = normalize_question(query)
+        if not question:
+            return None
+
+        answers = self._answers.get(question)
+        if answers is not None:
+            return (answers[0], "exact", question) if len(answers) == 1 else None
+        if not config.question_shortcut_fuzzy:
+            return None
+
+        grams = _trigrams(question)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        if not shared:
+            return None
+
+        best, best_score = None, 0.0
+        for idx, common in shared.items():
+            if self._questions[idx] not in self._answers:
+                continue
+            score = 2 * common / (len(grams) + self._sizes[idx])
+            if score > best_score:
+                best, best_score = idx, score
+
+        if best_score < config.question_shortcut_threshold:
+            return None
+        candidate = self._questions[best]
+        answers = self._answers.get(candidate)
+        if not answers or len(answers) != 1 or not _same_words(question, candidate):
+            return None
+        return answers[0], "fuzzy", candidate
+
+    def record(self, result: str) -> None:
+        self.counts[result] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counts["exact"] + self.counts["fuzzy"]
+        total = hits + self.counts["miss"]
+        answers = list(self._answers.values())
+        return {
+            "questions": len(answers),
+            "ambiguous": sum(1 for texts in answers if len(texts) > 1),
+            "exact": self.counts["exact"],
+            "fuzzy": self.counts["fuzzy"],
+            "misses": self.counts["miss"],
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+_question_index: Optional[QuestionIndex] = None
+
+
+def get_question_index() -> QuestionIndex:
+    global _question_index
+    if _question_index is None:
+        _question_index = QuestionIndex(config.question_index_path)
+    return _question_index
+
+
+async def index_questions(
+    texts: List[str], metadatas: Optional[List[Dict[str, Any]]]
+) -> int:
+    """Занести в индекс вопросы из метаданных чанков (поле question)."""
+    if not config.question_shortcut or not metadatas:
+        return 0
+    items = [
+        (str(meta["question"]), str(meta.get("source") or ""), text)
+        for text, meta in zip(texts, metadatas)
+        if meta and meta.get("question")
+    ]
+    if not items:
+        return 0
+    return await get_question_index().add(items)
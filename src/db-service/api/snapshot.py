@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from . import config
+from .cache import get_result_cache
+from .shortcut import index_questions
+from .store import ObjectBatch, VectorStore
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+
+def snapshot_path(name: str) -> Path:
+    """
+    Каталог снапшота по имени. Из запроса приходит только имя, а не путь:
+    снапшоты живут исключительно внутри snapshot_dir.
+    """
+    if not _NAME_RE.fullmatch(name) or ".." in name:
+        raise ValueError(
+            "Имя снапшота: латиница, цифры, '.', '_' и '-', не длиннее 64 символов"
+        )
+    root = Path(config.snapshot_dir).resolve()
+    path = (root / name).resolve()
+    if path.parent != root:
+        raise ValueError(f"Недопустимое имя снапшота: {name}")
+    return path
+
+
+def write_snapshot(path: Path, batches: Iterator[ObjectBatch]) -> Dict[str, Any]:
+    """
+    Записать снапшот коллекции в каталог path:
+    vectors.f32 — векторы подряд сырыми little-endian float32,
+    objects.jsonl — id, текст и метаданные, по строке на вектор,
+    manifest.json — число объектов, размерность и модель эмбеддингов.
+    Пишется во временный каталог и подменяет старый снапшот целиком.
+    """
+    target = path
+    # Имя снапшота не начинается с точки — временный каталог с ним не совпадет
+    tmp = target.with_name(f".{target.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    count, dim = 0, None
+    with open(tmp / "vectors.f32", "wb") as vectors_file, open(
+        tmp / "objects.jsonl", "w", encoding="utf-8"
+    ) as objects_file:
+        for ids, texts, metadatas, vectors in batches:
+            vectors = np.asarray(vectors, dtype="<f4")
+            if dim is None:
+                dim = int(vectors.shape[1])
+            elif vectors.shape[1] != dim:
+                raise RuntimeError(
+                    f"Размерность векторов {vectors.shape[1]} не совпадает с {dim}"
+                )
+            vectors_file.write(np.ascontiguousarray(vectors).tobytes())
+            for obj_id, text, meta in zip(ids, texts, metadatas):
+                objects_file.write(
+                    json.dumps(
+                        {"id": obj_id, "text": text, "metadata": meta},
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+            count += len(ids)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "count": count,
+        "dim": dim,
+        "dtype": "<f4",
+        "embed_model": config.embed_model or "",
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    (tmp / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+    if target.exists():
+        shutil.rmtree(target)
+    os.replace(tmp, target)
+    return manifest
+
+
+def read_manifest(path: Path) -> Dict[str, Any]:
+    manifest_path = Path(path) / "manifest.json"
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Снапшот не найден: {path.name}")
+    manifest = json.loads(manifest_path.read_text())
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Неизвестный формат снапшота: {manifest.get('format')}")
+    return manifest
+
+
+def read_snapshot(path: Path, batch_size: int) -> Iterator[ObjectBatch]:
+    """Читать снапшот пачками по batch_size объектов; векторы — через memmap."""
+    manifest = read_manifest(path)
+    count, dim = manifest["count"], manifest["dim"]
+    if not count:
+        return
+
+    vectors = np.memmap(
+        Path(path) / "vectors.f32", dtype="<f4", mode="r", shape=(count, dim)
+    )
+    with open(Path(path) / "objects.jsonl", encoding="utf-8") as f:
+        start = 0
+        batch: List[Dict[str, Any]] = []
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield _unpack(batch, vectors[start:start + len(batch)])
+                start += len(batch)
+                batch = []
+        if batch:
+            yield _unpack(batch, vectors[start:start + len(batch)])
+
+
+def _unpack(items: List[Dict[str, Any]], vectors: np.ndarray) -> ObjectBatch:
+    return (
+        [item["id"] for item in items],
+        [item["text"] for item in items],
+        [item.get("metadata") or {} for item in items],
+        np.array(vectors, dtype=np.float32),
+    )
+
+
+def check_compatible(manifest: Dict[str, Any]) -> None:
+    """Векторы другой модели в эту коллекцию не годятся."""
+    model = manifest.get("embed_model") or ""
+    if model and config.embed_model and model != config.embed_model:
+        raise ValueError(
+            f"Снапшот сделан моделью {model}, а сервис использует "
+            f"{config.embed_model}"
+        )
+
+
+async def export_snapshot(store: VectorStore, name: str) -> Dict[str, Any]:
+    """Выгрузить всю коллекцию в снапшот name, без обращения к эмбеддеру."""
+    path = snapshot_path(name)
+    started = time.perf_counter()
+    manifest = await asyncio.to_thread(
+        write_snapshot, path, store.iter_objects(config.snapshot_batch_size)
+    )
+    logger.info(
+        "snapshot export: path=%s objects=%d took=%.1fs",
+        path,
+        manifest["count"],
+        time.perf_counter() - started,
+    )
+    return manifest
+
+
+async def import_snapshot(store: VectorStore, name: str) -> Dict[str, int]:
+    """
+    Загрузить снапшот name в коллекцию готовыми векторами. Объекты, которые
+    уже есть в коллекции, пропускаются; вопросы Q&A из метаданных
+    попадают в индекс быстрых ответов.
+    """
+    path = snapshot_path(name)
+    started = time.perf_counter()
+    manifest = await asyncio.to_thread(read_manifest, path)
+    check_compatible(manifest)
+
+    # Коллекция пуста (например, после потери тома) — старое состояние
+    # маршрутизатора к ней не относится, иначе счетчики партиций удвоятся
+    if await store.count() == 0:
+        store.partitions.reset({}, {})
+
+    batches = read_snapshot(path, config.snapshot_batch_size)
+    added = skipped = 0
+    # Чанки с вопросами, которые уже лежат в коллекции: в индекс быстрых
+    # ответов они попадают после записи и одним вызовом — ответы вопроса
+    # могут оказаться в разных пачках
+    qa_texts: List[str] = []
+    qa_metadatas: List[Dict[str, Any]] = []
+    try:
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            ids, texts, metadatas, vectors = batch
+            existing = await store.existing_ids(ids)
+            fresh = [i for i, obj_id in enumerate(ids) if obj_id not in existing]
+            skipped += len(ids) - len(fresh)
+            if fresh:
+                await store.add(
+                    [texts[i] for i in fresh],
+                    vectors[fresh],
+                    [ids[i] for i in fresh],
+                    [metadatas[i] for i in fresh],
+                )
+                added += len(fresh)
+            for text, meta in zip(texts, metadatas):
+                if meta.get("question"):
+                    qa_texts.append(text)
+                    qa_metadatas.append(meta)
+    finally:
+        get_result_cache().bump_version()
+        await index_questions(qa_texts, qa_metadatas)
+
+    logger.info(
+        "snapshot import: path=%s added=%d skipped=%d took=%.1fs",
+        path,
+        added,
+        skipped,
+        time.perf_counter() - started,
+    )
+    return {"added": added, "skipped": skipped}
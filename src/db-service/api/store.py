@@ -0,0 +1,595 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from weaviate import Client
+
+from . import config
+from .quantization import top_indices
+from .routing import DEFAULT_PARTITION, PartitionRouter, partition_of
+from .utils import ensure_schema
+from .vectors import normalize, truncate
+
+
+logger = logging.getLogger(__name__)
+
+# Пачка объектов коллекции: (ids, texts, metadatas, векторы len x dim)
+ObjectBatch = Tuple[List[str], List[str], List[Dict[str, Any]], np.ndarray]
+
+# Сколько объектов Weaviate читать за запрос при полном обходе класса
+_SCAN_BATCH = 1000
+
+
+class VectorStore:
+    """
+    Общий неблокирующий интерфейс векторного хранилища.
+
+    Наследники реализуют синхронные _search/_existing_ids/_add/_debug
+    и _iter_objects,
+    а вызовы уходят в выделенные пулы потоков: поиск и запись живут
+    в разных пулах, поэтому запись большого батча не мешает поиску.
+
+    Каждый объект принадлежит тематической партиции (источник корпуса),
+    поиск можно ограничить одной партицией; partitions выбирает их
+    для запроса.
+    """
+
+    backend = "base"
+
+    def __init__(
+        self, search_workers: int, write_workers: int, partitions_path: str
+    ):
+        self.partitions = PartitionRouter(partitions_path)
+        self._search_pool = ThreadPoolExecutor(
+            max_workers=search_workers,
+            thread_name_prefix=f"{self.backend}-search",
+        )
+        self._write_pool = ThreadPoolExecutor(
+            max_workers=write_workers,
+            thread_name_prefix=f"{self.backend}-write",
+        )
+
+    async def _run(self, pool: ThreadPoolExecutor, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, partial(func, *args))
+
+    def _search(
+        self, vector: np.ndarray, limit: int, partition: Optional[str]
+    ) -> List[Dict]:
+        raise NotImplementedError
+
+    def _existing_ids(self, uuids: List[str]) -> Set[str]:
+        raise NotImplementedError
+
+    def _add(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        uuids: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        raise NotImplementedError
+
+    def _debug(self) -> dict:
+        raise NotImplementedError
+
+    def _iter_objects(self, batch_size: int) -> Iterator[ObjectBatch]:
+        raise NotImplementedError
+
+    def _count(self) -> int:
+        raise NotImplementedError
+
+    def _sync_partitions(self) -> None:
+        raise NotImplementedError
+
+    def _ping(self) -> None:
+        """Бросает исключение, если бэкенд недоступен."""
+
+    def _benchmark_index(self, k: int, samples: int) -> List[Dict]:
+        raise NotImplementedError(
+            f"Бенчмарк индекса не поддерживается бэкендом {self.backend}"
+        )
+
+    async def connect(self) -> None:
+        """Подключиться к бэкенду после старта приложения (если нужно)."""
+
+    async def ping(self) -> None:
+        """Проверить доступность бэкенда не дольше ready_timeout."""
+        await asyncio.wait_for(asyncio.to_thread(self._ping), config.ready_timeout)
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        limit: int,
+        partition: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        limit ближайших объектов к вектору, по возрастанию дистанции:
+        [{"text": str, "distance": float}, ...]. С partition — только
+        среди объектов этой партиции.
+        """
+        started = time.perf_counter()
+        found = await self._run(
+            self._search_pool, self._search, vector, limit, partition
+        )
+        logger.info(
+            "%s search: partition=%s limit=%d found=%d took=%.1fms",
+            self.backend,
+            partition or "*",
+            limit,
+            len(found),
+            (time.perf_counter() - started) * 1000,
+        )
+        return found
+
+    async def existing_ids(self, uuids: List[str]) -> Set[str]:
+        """Какие из переданных id уже есть в коллекции."""
+        if not uuids:
+            return set()
+        return await self._run(self._search_pool, self._existing_ids, uuids)
+
+    async def add(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        uuids: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        """
+        Записать объекты с готовыми векторами (матрица len(texts) x dim)
+        и метаданными (источник и курс сохраняются вместе с объектом).
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        started = time.perf_counter()
+        await self._run(
+            self._write_pool, self._write, texts, vectors, uuids, metadatas
+        )
+        logger.info(
+            "%s write: objects=%d took=%.1fms",
+            self.backend,
+            len(texts),
+            (time.perf_counter() - started) * 1000,
+        )
+
+    def _write(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        uuids: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        # Запись и счетчики партиций — одна задача пула записи: сверка
+        # в _sync_stale_partitions не застанет объекты без их партиций
+        self._add(texts, vectors, uuids, metadatas)
+        self.partitions.add([partition_of(meta) for meta in metadatas], vectors)
+
+    def _sync_stale_partitions(self) -> bool:
+        if self._count() == self.partitions.total():
+            return False
+        self._sync_partitions()
+        return True
+
+    def iter_objects(self, batch_size: int) -> Iterator[ObjectBatch]:
+        """
+        Все объекты коллекции пачками по batch_size вместе с векторами
+        и метаданными. Синхронный генератор — читать из потока, не из
+        event loop.
+        """
+        return self._iter_objects(batch_size)
+
+    async def count(self) -> int:
+        """Число объектов в коллекции."""
+        return await self._run(self._search_pool, self._count)
+
+    async def sync_partitions(self) -> bool:
+        """
+        Сверить маршрутизатор с коллекцией по числу объектов и пересчитать
+        его по всем векторам, если они разошлись (корпус перезалит, том
+        потерян, объекты загружены до появления партиций). И сверка, и
+        пересчет идут в пуле записи между записями батчей. Пересчет читает
+        всю коллекцию и может перезаписать объекты, поэтому вызывается
+        только при старте и по POST /partitions/sync. True — пересчитано.
+        """
+        return await self._run(self._write_pool, self._sync_stale_partitions)
+
+    async def debug(self) -> dict:
+        return await self._run(self._search_pool, self._debug)
+
+    async def benchmark_index(self, k: int, samples: int) -> List[Dict]:
+        """Память, recall@k и задержка режимов индекса на векторах корпуса."""
+        return await self._run(
+            self._search_pool, self._benchmark_index, k, samples
+        )
+
+    def close(self) -> None:
+        self._search_pool.shutdown(wait=False, cancel_futures=True)
+        self._write_pool.shutdown(wait=True)
+
+
+class WeaviateStore(VectorStore):
+    """
+    Хранилище поверх синхронного weaviate-клиента.
+    Запись идет в один поток — client.batch хранит состояние на клиенте.
+
+    С ANN_DIM в HNSW индексируется усеченный вектор, а полный лежит
+    в неиндексируемом свойстве full_vector и нужен только для
+    рескоринга шортлиста. Класс должен быть создан с тем же ANN_DIM.
+
+    Клиент создается не в конструкторе: connect подключается и готовит
+    схему в фоне после старта, а если Weaviate так и не поднялся —
+    подключение повторяется лениво при первом обращении.
+    """
+
+    backend = "weaviate"
+
+    def __init__(self, url: str, class_name: str = "doc"):
+        super().__init__(
+            config.weaviate_search_workers,
+            config.weaviate_write_workers,
+            config.partitions_path,
+        )
+        self.url = url
+        self.class_name = class_name
+        self._client: Optional[Client] = None
+        self._schema_error: Optional[ValueError] = None
+        self._connect_lock = threading.Lock()
+
+    def _connect(self, wait: bool = True) -> Client:
+        # Пока идет подключение, запросы не ждут его, а сразу получают ошибку
+        if not self._connect_lock.acquire(blocking=wait):
+            raise RuntimeError("Подключение к Weaviate еще не установлено")
+        try:
+            # Схема несовместима с конфигурацией — повторять бесполезно
+            if self._schema_error is not None:
+                raise self._schema_error
+            if self._client is None:
+                client = Client(
+                    self.url,
+                    timeout_config=(config.http_connect_timeout, 60),
+                    startup_period=None,
+                )
+                try:
+                    ensure_schema(client, self.class_name)
+                except ValueError as e:
+                    self._schema_error = e
+                    raise
+                self._client = client
+            return self._client
+        finally:
+            self._connect_lock.release()
+
+    @property
+    def client(self) -> Client:
+        client = self._client
+        if client is None:
+            client = self._connect(wait=False)
+        return client
+
+    async def connect(self) -> None:
+        """
+        Подключиться к Weaviate и создать схему: до weaviate_connect_retries
+        попыток с экспоненциальной паузой. Неудача не роняет сервис —
+        /ready остается красным, а запросы пробуют подключиться сами.
+        """
+        retries = max(1, config.weaviate_connect_retries)
+        delay = config.weaviate_connect_backoff
+        for attempt in range(1, retries + 1):
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._connect)
+            except ValueError as e:
+                logger.error("weaviate: schema does not match config: %s", e)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    logger.error(
+                        "weaviate: connect to %s failed after %d attempts: %s",
+                        self.url,
+                        attempt,
+                        e,
+                    )
+                    return
+                logger.warning(
+                    "weaviate: connect attempt %d/%d failed: %s; retry in %.1fs",
+                    attempt,
+                    retries,
+                    e,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.weaviate_connect_backoff_max)
+            else:
+                logger.info(
+                    "weaviate: connected to %s, attempt=%d took=%.1fms",
+                    self.url,
+                    attempt,
+                    (time.perf_counter() - started) * 1000,
+                )
+                break
+
+        try:
+            if await self.sync_partitions():
+                logger.info(
+                    "weaviate: partitions rebuilt: %s", self.partitions.stats()
+                )
+        except Exception as e:
+            logger.warning("weaviate: partition sync failed: %s", e)
+
+    def _count(self) -> int:
+        res = (
+            self.client.query.aggregate(self.class_name).with_meta_count().do()
+        )
+        if "errors" in res:
+            raise RuntimeError(res["errors"])
+        groups = res["data"]["Aggregate"].get(self.class_name.capitalize()) or []
+        return int(groups[0]["meta"]["count"]) if groups else 0
+
+    def _ping(self) -> None:
+        if not self.client.is_ready():
+            raise RuntimeError("Weaviate не готов")
+
+    def _query(self, properties: List[str], partition: Optional[str]):
+        query = self.client.query.get(self.class_name, properties)
+        if partition is not None:
+            query = query.with_where(
+                {"path": ["source"], "operator": "Equal", "valueText": partition}
+            )
+        return query
+
+    def _search(
+        self, vector: np.ndarray, limit: int, partition: Optional[str]
+    ) -> List[Dict]:
+        if config.ann_dim > 0:
+            return self._search_truncated(vector, limit, partition)
+
+        res = (
+            self._query(["text"], partition)
+            .with_near_vector({"vector": np.asarray(vector).tolist()})
+            .with_additional(["distance"])
+            .with_limit(limit)
+            .do()
+        )
+        return [
+            {
+                "text": obj["text"],
+                "distance": (obj.get("_additional") or {}).get("distance"),
+            }
+            for obj in self._objects(res)
+        ]
+
+    def _search_truncated(
+        self, vector: np.ndarray, limit: int, partition: Optional[str]
+    ) -> List[Dict]:
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        return self._rescore(query, self._shortlist(query, limit, partition), limit)
+
+    def _shortlist(
+        self, query: np.ndarray, limit: int, partition: Optional[str]
+    ) -> List[Dict]:
+        """Шортлист по усеченному вектору вместе с полными векторами."""
+        res = (
+            self._query(["text", "full_vector"], partition)
+            .with_near_vector({"vector": truncate(query, config.ann_dim).tolist()})
+            .with_limit(limit * config.weaviate_rescore_factor)
+            .do()
+        )
+        return [obj for obj in self._objects(res) if obj.get("full_vector")]
+
+    @staticmethod
+    def _rescore(query: np.ndarray, objects: List[Dict], limit: int) -> List[Dict]:
+        if not objects:
+            return []
+        full = normalize(
+            np.asarray([obj["full_vector"] for obj in objects], dtype=np.float32)
+        )
+        scores = full @ query
+        return [
+            {"text": objects[i]["text"], "distance": float(1.0 - scores[i])}
+            for i in top_indices(scores, limit)
+        ]
+
+    def _objects(self, res: dict) -> List[Dict]:
+        if "errors" in res:
+            raise RuntimeError(res["errors"])
+        return res["data"]["Get"].get(self.class_name.capitalize(), [])
+
+    def _existing_ids(self, uuids: List[str]) -> Set[str]:
+        res = (
+            self.client.query.get(self.class_name)
+            .with_additional(["id"])
+            .with_where(
+                {
+                    "path": ["id"],
+                    "operator": "ContainsAny",
+                    "valueTextArray": uuids,
+                }
+            )
+            .with_limit(len(uuids))
+            .do()
+        )
+        return {obj["_additional"]["id"] for obj in self._objects(res)}
+
+    def _add(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        uuids: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        with self.client.batch(batch_size=config.weaviate_batch_size) as batch:
+            for text, vector, obj_uuid, meta in zip(texts, vectors, uuids, metadatas):
+                data_object = {
+                    "text": text,
+                    "source": partition_of(meta),
+                    "course": str(meta.get("course") or ""),
+                    "metadata": json.dumps(meta, ensure_ascii=False),
+                }
+                if config.ann_dim > 0:
+                    data_object["full_vector"] = np.asarray(vector).tolist()
+                    vector = truncate(vector, config.ann_dim)
+                batch.add_data_object(
+                    data_object=data_object,
+                    class_name=self.class_name,
+                    uuid=obj_uuid,
+                    vector=np.asarray(vector).tolist(),
+                )
+
+    def _scan(self, batch_size: int) -> Iterator[List[Dict]]:
+        """Все объекты класса с векторами, пачками по batch_size."""
+        # Курсор по id: в отличие от offset не деградирует на больших классах
+        cursor = None
+        while True:
+            res = self.client.data_object.get(
+                class_name=self.class_name,
+                with_vector=True,
+                limit=batch_size,
+                after=cursor,
+            )
+            objects = (res or {}).get("objects") or []
+            if not objects:
+                return
+            cursor = objects[-1]["id"]
+            yield objects
+
+    def _iter_objects(self, batch_size: int) -> Iterator[ObjectBatch]:
+        for objects in self._scan(batch_size):
+            ids, texts, metadatas, vectors = [], [], [], []
+            for obj in objects:
+                props = obj.get("properties") or {}
+                # С ANN_DIM индексный вектор усечен, полный — в full_vector
+                vector = props.get("full_vector") or obj.get("vector")
+                if not vector:
+                    continue
+                ids.append(obj["id"])
+                texts.append(props.get("text") or "")
+                metadatas.append(self._metadata(props))
+                vectors.append(vector)
+            if ids:
+                yield ids, texts, metadatas, np.asarray(vectors, dtype=np.float32)
+
+    def _sync_partitions(self) -> None:
+        sums: Dict[str, np.ndarray] = {}
+        counts: Dict[str, int] = {}
+        for objects in self._scan(_SCAN_BATCH):
+            unlabeled = []
+            for obj in objects:
+                props = obj.get("properties") or {}
+                vector = props.get("full_vector") or obj.get("vector")
+                if not vector:
+                    continue
+                vector = normalize(np.asarray(vector, dtype=np.float32))
+                name = props.get("source") or DEFAULT_PARTITION
+                sums[name] = sums[name] + vector if name in sums else vector
+                counts[name] = counts.get(name, 0) + 1
+                if not props.get("source"):
+                    unlabeled.append((obj["id"], props.get("text") or "", vector))
+
+            # Объекты, записанные до появления метаданных, фильтр по source
+            # не находит: перезаписываем их с партицией по умолчанию
+            if unlabeled:
+                ids, texts, vectors = zip(*unlabeled)
+                self._add(
+                    list(texts), np.stack(vectors), list(ids), [{} for _ in ids]
+                )
+        self.partitions.reset(sums, counts)
+
+    def _benchmark_index(self, k: int, samples: int) -> List[Dict]:
+        """
+        Варианты первого прохода (квантование, Matryoshka-размерности)
+        в процессе на векторах класса, как у локального хранилища, плюс
+        строка с живыми запросами в HNSW Weaviate в текущем режиме ANN_DIM.
+        Читает все векторы класса в память.
+        """
+        from .benchmark import index_benchmark
+
+        texts: List[str] = []
+        batches = []
+        for _, batch_texts, _, batch_vectors in self._iter_objects(_SCAN_BATCH):
+            texts.extend(batch_texts)
+            batches.append(batch_vectors)
+        if len(texts) <= k:
+            return []
+        vectors = normalize(np.concatenate(batches))
+
+        report = index_benchmark(vectors, k, samples, config.weaviate_rescore_factor)
+        report.append(self._benchmark_live(texts, vectors, k, samples))
+        return report
+
+    def _benchmark_live(
+        self, texts: List[str], vectors: np.ndarray, k: int, samples: int
+    ) -> Dict:
+        # Те же запросы, что в index_benchmark: векторы корпуса без самих себя
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(vectors), min(samples, len(vectors)), replace=False)
+        hits = 0
+        elapsed = 0.0
+        # С ANN_DIM отдельно меряем, во что обходится перекачка полных
+        # векторов шортлиста: их число и объем JSON на запрос
+        rescore_vectors = rescore_bytes = 0
+        for i in sample:
+            scores = vectors @ vectors[i]
+            scores[i] = -np.inf
+            truth = {texts[j] for j in top_indices(scores, k)}
+
+            objects: List[Dict] = []
+            started = time.perf_counter()
+            if config.ann_dim > 0:
+                objects = self._shortlist(vectors[i], k + 1, None)
+                found = self._rescore(vectors[i], objects, k + 1)
+            else:
+                found = self._search(vectors[i], k + 1, None)
+            elapsed += time.perf_counter() - started
+            rescore_vectors += len(objects)
+            rescore_bytes += sum(
+                len(json.dumps(obj["full_vector"])) for obj in objects
+            )
+            top = [c["text"] for c in found if c["text"] != texts[i]][:k]
+            hits += len(truth & set(top))
+
+        row = {
+            "mode": f"weaviate-{config.weaviate_quantization}",
+            "dim": config.ann_dim or int(vectors.shape[1]),
+            "memory_bytes": None,
+            f"recall@{k}": round(hits / (k * len(sample)), 4),
+            "latency_ms": round(elapsed / len(sample) * 1000, 3),
+        }
+        if config.ann_dim > 0:
+            row["rescore_vectors"] = round(rescore_vectors / len(sample), 1)
+            row["rescore_bytes"] = int(rescore_bytes / len(sample))
+        return row
+
+    @staticmethod
+    def _metadata(props: Dict[str, Any]) -> Dict[str, Any]:
+        if props.get("metadata"):
+            return json.loads(props["metadata"])
+        # Объекты, записанные до появления свойства metadata
+        return {
+            key: props[key] for key in ("source", "course") if props.get(key)
+        }
+
+    def _debug(self) -> dict:
+        return {
+            "schema": self.client.schema.get(),
+            "aggregate_doc": self.client.query.aggregate(self.class_name)
+            .with_meta_count()
+            .do(),
+        }
+
+
+def create_store() -> VectorStore:
+    """
+    Хранилище по VECTOR_STORE: weaviate (по умолчанию) или local.
+    К Weaviate не подключается — это делает connect в lifespan.
+    """
+    if config.vector_store == "local":
+        from .local_store import LocalStore
+
+        return LocalStore(config.local_store_path)
+
+    return WeaviateStore(config.weaviate_url, "doc")
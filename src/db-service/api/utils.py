@@ -1,21 +1,43 @@
-import os
+import time
 import uuid
-import json
-from typing import List
+import base64
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
 import logging
 
-import requests
+import httpx
+import numpy as np
 from weaviate import Client
 
+from . import config
+from .batcher import MicroBatcher
+from .cache import get_embedding_cache, get_score_cache
+from .clients import get_embed_client, get_reranker_client
+from .late_interaction import late_interaction_scores
 
-embed_url = os.getenv("EMBEDDING_URL")
-embed_model = os.getenv("EMBEDDING_MODEL")
-reranker_url = os.getenv("RERANKER_URL")
-reranker_model = os.getenv("RERANKER_MODEL")
+
+logger = logging.getLogger(__name__)
+
+
+# Метаданные чанка: по source фильтруется поиск по партициям
+_META_PROPERTIES = [
+    {"name": "source", "dataType": ["text"], "tokenization": "field"},
+    {"name": "course", "dataType": ["text"], "tokenization": "field"},
+    # Все метаданные чанка JSON-строкой: нужны для снапшотов, не для поиска
+    {
+        "name": "metadata",
+        "dataType": ["text"],
+        "indexFilterable": False,
+        "indexSearchable": False,
+    },
+]
 
 
 def ensure_schema(client: Client, name: str) -> None:
-    """Создать класс в Weaviate, если его еще нет."""
+    """Создать класс в Weaviate, если его еще нет, и добавить новые свойства."""
+    # Встроенное квантование HNSW в Weaviate: int8 -> SQ, binary -> BQ
+    quantizer = {"int8": "sq", "binary": "bq"}.get(config.weaviate_quantization)
+
     if not client.schema.exists(name):
         schema = {
             "class": name,
@@ -24,76 +46,491 @@ def ensure_schema(client: Client, name: str) -> None:
                 {
                     "name": "text",
                     "dataType": ["text"],
-                }
+                },
+                *_META_PROPERTIES,
             ],
         }
+        if config.ann_dim > 0:
+            # Полный вектор для рескоринга, в HNSW идет усеченный
+            schema["properties"].append(
+                {
+                    "name": "full_vector",
+                    "dataType": ["number[]"],
+                    "indexFilterable": False,
+                }
+            )
+        if quantizer == "sq":
+            schema["vectorIndexConfig"] = {
+                "sq": {
+                    "enabled": True,
+                    "trainingLimit": config.weaviate_sq_training_limit,
+                }
+            }
+        elif quantizer == "bq":
+            schema["vectorIndexConfig"] = {"bq": {"enabled": True}}
         client.schema.create_class(schema)
+        return
 
+    class_schema = client.schema.get(name)
+    existing = {prop["name"] for prop in class_schema.get("properties", [])}
 
-async def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Получить эмбеддинги из vLLM‑эмбеддера."""
-    try:
-        resp = requests.post(
-            f"{embed_url}/v1/embeddings",
-            json={
-                "input": texts,
-                "model": embed_model,
-            },
-            timeout=60,
+    # Квантование задается при создании класса: на существующем классе
+    # WEAVIATE_QUANTIZATION ничего не меняет
+    index_config = class_schema.get("vectorIndexConfig") or {}
+    if quantizer and not (index_config.get(quantizer) or {}).get("enabled"):
+        logger.warning(
+            "weaviate: WEAVIATE_QUANTIZATION=%s не применяется — класс %s "
+            "создан без него; пересоздайте класс и загрузите корпус заново",
+            config.weaviate_quantization,
+            name,
+        )
+    elif quantizer == "sq":
+        training_limit = index_config["sq"].get("trainingLimit")
+        if training_limit and training_limit > config.weaviate_sq_training_limit:
+            logger.warning(
+                "weaviate: SQ класса %s обучится только после %d объектов "
+                "(WEAVIATE_SQ_TRAINING_LIMIT=%d применяется к новым классам)",
+                name,
+                training_limit,
+                config.weaviate_sq_training_limit,
+            )
+    # Режим ANN_DIM задается при создании класса: в HNSW лежат векторы
+    # одной размерности, поэтому переключить его на существующем классе
+    # нельзя — иначе каждый поиск падал бы уже на запросе
+    if config.ann_dim > 0 and "full_vector" not in existing:
+        raise ValueError(
+            f"Класс {name} создан без ANN_DIM (нет свойства full_vector): "
+            f"уберите ANN_DIM или пересоздайте класс и загрузите корпус заново"
+        )
+    if config.ann_dim <= 0 and "full_vector" in existing:
+        raise ValueError(
+            f"Класс {name} создан с ANN_DIM (в HNSW усеченные векторы): "
+            f"задайте тот же ANN_DIM или пересоздайте класс"
         )
-    except requests.RequestException as e:
+
+    # Класс создан до появления метаданных: добавляем свойства, старые
+    # объекты получат source при пересчете партиций (sync_partitions)
+    for prop in _META_PROPERTIES:
+        if prop["name"] not in existing:
+            client.schema.property.create(name, prop)
+
+
+# Пространство имен для детерминированных id чанков
+CHUNK_NAMESPACE = uuid.UUID("5b0c2a7e-3f43-4d8e-9a52-1c6f0f6b7d21")
+
+
+def chunk_uuid(text: str) -> str:
+    """Id чанка по его содержимому: один и тот же текст — один и тот же объект."""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, text))
+
+
+def _decode_embedding(embedding) -> np.ndarray:
+    """base64 little-endian float32 (или обычный JSON-список) -> массив."""
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+async def ping_embedder() -> None:
+    """Проверка готовности эмбеддера (vLLM /health) для /ready."""
+    resp = await get_embed_client().get("/health", timeout=config.ready_timeout)
+    if resp.status_code != 200:
+        raise RuntimeError(f"Эмбеддер вернул {resp.status_code}")
+
+
+async def _embed_request(texts: List[str]) -> np.ndarray:
+    """
+    Получить эмбеддинги из vLLM‑эмбеддера матрицей (len(texts), dim).
+    По умолчанию векторы передаются в base64, а не JSON-массивами float.
+    """
+    payload = {
+        "input": texts,
+        "model": config.embed_model,
+    }
+    if config.embed_base64:
+        payload["encoding_format"] = "base64"
+
+    started = time.perf_counter()
+    try:
+        resp = await get_embed_client().post("/v1/embeddings", json=payload)
+    except httpx.HTTPError as e:
         raise RuntimeError(f"Ошибка запроса к эмбеддеру: {e}")
 
     if resp.status_code != 200:
         raise RuntimeError(
             f"Эмбеддер вернул {resp.status_code}: {resp.text[:500]}"
         )
+    received = time.perf_counter()
 
-    data = resp.json()
-    return [item["embedding"] for item in data["data"]]
+    data = sorted(resp.json()["data"], key=lambda item: item.get("index", 0))
+    vectors = np.stack([_decode_embedding(item["embedding"]) for item in data])
 
+    logger.info(
+        "embed: texts=%d bytes=%d request=%.1fms decode=%.1fms",
+        len(texts),
+        len(resp.content),
+        (received - started) * 1000,
+        (time.perf_counter() - received) * 1000,
+    )
+    return vectors
 
-async def rerank(
-    query: str,
-    documents: List[str],
-    top_k: int = 7
-) -> List[dict]:
+
+async def _embed_unique(texts: List[str]) -> List[np.ndarray]:
     """
-    Реранк кандидатов
-    Возвращает список словарей [{"index": int, "score": float}, ...]
-    отсортированных по score по убыванию и обрезанных до top_k.
+    Эмбеддинги с дедупликацией: одинаковые строки (например, повтор
+    запроса после ретрая) считаются один раз.
     """
-    if not documents:
-        return []
+    unique = list(dict.fromkeys(texts))
+    if len(unique) < len(texts):
+        logger.info("embed: dedup %d -> %d", len(texts), len(unique))
+    embedded = dict(zip(unique, await _embed_request(unique)))
+    return [embedded[text] for text in texts]
+
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Эмбеддинги матрицей (len(texts), dim). С EMBED_COALESCE тексты
+    конкурентных вызовов (поиск, загрузка) уходят в эмбеддер общим батчем.
+    """
+    if config.embed_coalesce:
+        vectors = await get_embed_batcher().submit(list(texts))
+    else:
+        vectors = await _embed_unique(texts)
+    return np.stack(vectors)
+
+
+async def embed_queries(texts: List[str]) -> List[np.ndarray]:
+    """
+    Эмбеддинги поисковых запросов через кэш: повторные запросы
+    не доходят до GPU, остальные уходят в эмбеддер одним вызовом.
+    """
+    cache = get_embedding_cache()
+    vectors = [await cache.get(text) for text in texts]
+
+    missing = list(
+        dict.fromkeys(text for text, vec in zip(texts, vectors) if vec is None)
+    )
+    if missing:
+        embedded = dict(zip(missing, await embed_texts(missing)))
+        for text, vector in embedded.items():
+            await cache.set(text, vector)
+        vectors = [
+            vec if vec is not None else embedded[text]
+            for text, vec in zip(texts, vectors)
+        ]
+
+    return vectors
+
+
+async def embed_query(text: str) -> np.ndarray:
+    """Эмбеддинг одного поискового запроса через кэш."""
+    return (await embed_queries([text]))[0]
+
+
+async def _score_request(payload: dict) -> httpx.Response:
+    """Один POST в /v1/score реранкера."""
+    try:
+        return await get_reranker_client().post("/v1/score", json=payload)
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"Ошибка запроса к реранкеру: {e}")
+
+
+def _parse_scores(data: dict, expected: int) -> List[float]:
+    """
+    Достать score из ответа /v1/score.
+    Поддерживает и одиночный ответ {"score": ...}, и списочный
+    {"data": [{"index": i, "score": ...}, ...]}.
+    """
+    if "score" in data and expected == 1:
+        return [float(data["score"])]
+
+    items = data.get("data") or []
+    if len(items) != expected:
+        raise RuntimeError(
+            f"Не удалось получить score из ответа реранкера: {data}"
+        )
+
+    scores = [0.0] * expected
+    for pos, item in enumerate(items):
+        scores[item.get("index", pos)] = float(item.get("score", 0.0))
+    return scores
+
+
+async def _rerank_batch(query: str, documents: List[str]) -> List[float]:
+    """Все пары (query, doc) одним запросом к реранкеру."""
+    payload = {
+        "model": config.reranker_model,
+        "text_1": query,
+        "text_2": documents,
+    }
+    resp = await _score_request(payload)
+
+    if resp.status_code != 200:
+        raise RuntimeError(
+            f"Реранкер вернул {resp.status_code}: {resp.text[:500]}"
+        )
 
-    results: List[Dict] = []
+    return _parse_scores(resp.json(), len(documents))
 
-    for idx, doc in enumerate(documents):
+
+async def _rerank_single(query: str, documents: List[str]) -> List[float]:
+    """По запросу на документ, не больше reranker_concurrency одновременно."""
+    semaphore = asyncio.Semaphore(max(1, config.reranker_concurrency))
+
+    async def score_one(doc: str) -> float:
         payload = {
-            "model": reranker_model,
+            "model": config.reranker_model,
             "text_1": query,
             "text_2": doc,
         }
-
-        resp = requests.post(f"{reranker_url}/v1/score", json=payload)
+        async with semaphore:
+            resp = await _score_request(payload)
 
         if resp.status_code != 200:
             raise RuntimeError(
                 f"Реранкер вернул {resp.status_code}: {resp.text[:500]}"
             )
 
-        data = resp.json()
+        return _parse_scores(resp.json(), 1)[0]
 
-        if "score" in data:
-            score = float(data["score"])
-        elif "data" in data and data["data"]:
-            score = float(data["data"][0].get("score", 0.0))
-        else:
+    return list(await asyncio.gather(*(score_one(doc) for doc in documents)))
+
+
+async def _score_query(query: str, documents: List[str]) -> List[float]:
+    """
+    Оценки реранкера для документов одного запроса: по умолчанию одним
+    запросом, если бэкенд батч не принимает — параллельными одиночными.
+    """
+    started = time.perf_counter()
+    mode = "batch"
+    scores = None
+
+    if config.reranker_batch:
+        try:
+            scores = await _rerank_batch(query, documents)
+        except RuntimeError as e:
+            logger.warning("Батчевый реранк не удался, фолбэк: %s", e)
+
+    if scores is None:
+        mode = "single"
+        scores = await _rerank_single(query, documents)
+
+    logger.info(
+        "rerank: mode=%s docs=%d took=%.1fms",
+        mode,
+        len(documents),
+        (time.perf_counter() - started) * 1000,
+    )
+    return scores
+
+
+async def _score_pairs(pairs: List[Tuple[str, str]]) -> List[float]:
+    """
+    Оценки для пар (запрос, документ) разных запросов одним вызовом
+    /v1/score: text_1 и text_2 — списки одинаковой длины. Если бэкенд
+    так не умеет, пары разбираются по запросам.
+    """
+    started = time.perf_counter()
+    payload = {
+        "model": config.reranker_model,
+        "text_1": [query for query, _ in pairs],
+        "text_2": [doc for _, doc in pairs],
+    }
+    try:
+        resp = await _score_request(payload)
+        if resp.status_code != 200:
             raise RuntimeError(
-                f"Не удалось получить score из ответа реранкера: {data}"
+                f"Реранкер вернул {resp.status_code}: {resp.text[:500]}"
+            )
+        scores = _parse_scores(resp.json(), len(pairs))
+    except RuntimeError as e:
+        logger.warning("Попарный реранк не удался, разбираем по запросам: %s", e)
+        by_query: Dict[str, List[int]] = {}
+        for idx, (query, _) in enumerate(pairs):
+            by_query.setdefault(query, []).append(idx)
+
+        per_query = await asyncio.gather(
+            *(
+                _score_query(query, [pairs[i][1] for i in idxs])
+                for query, idxs in by_query.items()
+            )
+        )
+        scores = [0.0] * len(pairs)
+        for idxs, query_scores in zip(by_query.values(), per_query):
+            for idx, score in zip(idxs, query_scores):
+                scores[idx] = score
+        return scores
+
+    logger.info(
+        "rerank: mode=pairs pairs=%d took=%.1fms",
+        len(pairs),
+        (time.perf_counter() - started) * 1000,
+    )
+    return scores
+
+
+_embed_batcher: Optional[MicroBatcher] = None
+_rerank_batcher: Optional[MicroBatcher] = None
+
+
+def get_embed_batcher() -> MicroBatcher:
+    global _embed_batcher
+    if _embed_batcher is None:
+        _embed_batcher = MicroBatcher(
+            "embed",
+            _embed_unique,
+            config.embed_batch_max_wait_ms,
+            config.embed_batch_max_size,
+            config.embed_batch_max_inflight,
+        )
+    return _embed_batcher
+
+
+def get_rerank_batcher() -> MicroBatcher:
+    global _rerank_batcher
+    if _rerank_batcher is None:
+        _rerank_batcher = MicroBatcher(
+            "rerank",
+            _score_pairs,
+            config.rerank_batch_max_wait_ms,
+            config.rerank_batch_max_size,
+            config.rerank_batch_max_inflight,
+        )
+    return _rerank_batcher
+
+
+async def close_batchers() -> None:
+    """Остановить микробатчеры. Вызывается при остановке."""
+    global _embed_batcher, _rerank_batcher
+    if _embed_batcher is not None:
+        await _embed_batcher.close()
+        _embed_batcher = None
+    if _rerank_batcher is not None:
+        await _rerank_batcher.close()
+        _rerank_batcher = None
+
+
+async def _cross_encoder_scores(query: str, documents: List[str]) -> List[float]:
+    """
+    Оценки кросс-энкодера для документов. С RERANK_COALESCE пары уходят
+    в общий микробатч с конкурентными запросами других пользователей.
+    """
+    if config.reranker_batch and config.rerank_coalesce:
+        return await get_rerank_batcher().submit(
+            [(query, doc) for doc in documents]
+        )
+    return await _score_query(query, documents)
+
+
+async def _score_documents(query: str, documents: List[str]) -> List[float]:
+    """Оценки реранкера в режиме RERANK_MODE: cross или late."""
+    if config.rerank_mode == "late":
+        return await late_interaction_scores(query, documents)
+    return await _cross_encoder_scores(query, documents)
+
+
+# Фоновые дореранки, переживающие дедлайн запроса: держим ссылки,
+# чтобы задачи не собрал GC, пока они заполняют кэш оценок.
+# Не больше config.rerank_background_max одновременно
+_background: Set[asyncio.Task] = set()
+
+
+async def rerank_with_deadline(
+    query: str,
+    documents: List[str],
+    top_k: int = 7,
+    timeout: Optional[float] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Реранк с ограничением по времени (timeout в секундах, None — без него).
+
+    Возвращает (результаты, деградация): None — полный реранк;
+    "partial" — реранкер не успел, сверху идут документы с оценками
+    из кэша, дальше остальные в порядке векторного поиска;
+    "vector" — оценок нет вовсе, порядок векторного поиска.
+    Неуспевший запрос к реранкеру доигрывается в фоне и пополняет кэш,
+    если фоновых дореранков меньше RERANK_BACKGROUND_MAX, иначе отменяется.
+    """
+    if not documents:
+        return [], None
+
+    cache = get_score_cache()
+    scores = cache.get_many(query, documents)
+    missing = [idx for idx, score in enumerate(scores) if score is None]
+    degraded = None
+
+    if missing:
+        missing_docs = [documents[idx] for idx in missing]
+
+        async def score_and_cache() -> List[float]:
+            fetched = await _score_documents(query, missing_docs)
+            cache.set_many(query, missing_docs, fetched)
+            return fetched
+
+        task = None
+        try:
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError
+            task = asyncio.ensure_future(score_and_cache())
+            fetched = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.CancelledError:
+            # Вызывающий ушел (например, отключился клиент) — реранк не нужен
+            if task is not None:
+                task.cancel()
+            raise
+        except asyncio.TimeoutError:
+            if task is not None and not task.done():
+                if len(_background) < config.rerank_background_max:
+                    _background.add(task)
+                    task.add_done_callback(_background.discard)
+                else:
+                    task.cancel()
+                    logger.warning(
+                        "rerank: %d фоновых дореранков, запрос отменен",
+                        len(_background),
+                    )
+            degraded = "vector" if len(missing) == len(documents) else "partial"
+            logger.warning(
+                "rerank: не уложились в %.0fms, деградация=%s",
+                (timeout or 0) * 1000,
+                degraded,
             )
+        else:
+            for idx, score in zip(missing, fetched):
+                scores[idx] = score
+
+    logger.info(
+        "rerank: docs=%d cached=%d",
+        len(documents),
+        len(documents) - len(missing),
+    )
 
-        results.append({"index": idx, "score": score})
+    scored: List[Dict] = [
+        {"index": idx, "score": score}
+        for idx, score in enumerate(scores)
+        if score is not None
+    ]
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    unscored = [
+        {"index": idx, "score": None}
+        for idx, score in enumerate(scores)
+        if score is None
+    ]
+    return (scored + unscored)[:top_k], degraded
 
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results[:top_k]
+
+async def rerank(
+    query: str,
+    documents: List[str],
+    top_k: int = 7
+) -> List[dict]:
+    """
+    Реранк кандидатов
+    Возвращает список словарей [{"index": int, "score": float}, ...]
+    отсортированных по score по убыванию и обрезанных до top_k.
+
+    Оценки уже виденных пар (запрос, чанк) берутся из кэша,
+    в реранкер уходят только новые пары.
+    """
+    results, _ = await rerank_with_deadline(query, documents, top_k)
+    return results
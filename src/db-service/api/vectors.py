@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-нормировка по последней оси: косинус сводится к скалярному произведению."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Matryoshka-усечение: первые dim измерений с повторной нормировкой.
+    dim <= 0 или не меньше исходной размерности — вектор без изменений.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dim <= 0 or dim >= vectors.shape[-1]:
+        return vectors
+    return normalize(vectors[..., :dim])